@@ -1,7 +1,10 @@
+import asyncio
+from contextlib import suppress
+from datetime import date, datetime, timedelta, timezone
 from functools import reduce
 from operator import add
 from os import getenv
-from typing import Annotated, Optional
+from typing import Annotated, Optional, TYPE_CHECKING
 
 import fastapi
 from fastapi import Depends, FastAPI, HTTPException, Request
@@ -9,20 +12,52 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.security import APIKeyHeader
 from fastapi.utils import is_body_allowed_for_status_code
-from limits import parse, storage, strategies
-
-from cdn import upload_image, upload_version
-from constants import SortDirection, SortType, TEMPLATES_DIR
-from database.database import database, Database, database_fake, fill_cache
+from limits import parse
+
+from cdn import construct_version_path, upload_image, upload_version, uploader
+from constants import RATE_LIMIT_CACHE_BYTES, SortDirection, SortType, STATS_DEFAULT_DAYS, TEMPLATES_DIR
+from database.cache import CachedResponse, PluginCache
+from database.database import (
+    compact_counters_periodically,
+    database,
+    Database,
+    database_fake,
+    fill_cache,
+    flush_counters,
+    flush_counters_periodically,
+    fold_counts_periodically,
+    plugin_cache,
+    prune_stats_periodically,
+)
 from database.models import Announcement
 from discord import post_announcement
+from limiter import BlockedCache, FixedWindowRateLimiter
 
 from .models import announcements as api_announcements
 from .models import delete as api_delete
+from .models import increment as api_increment
 from .models import list as api_list
+from .models import rate_limit as api_rate_limit
+from .models import stats as api_stats
 from .models import submit as api_submit
 from .models import update as api_update
-from .utils import FormBody, getIpHash, UUID7
+from .utils import (
+    conditional_json_response,
+    decode_cursor,
+    encode_cursor,
+    FormBody,
+    getIpHash,
+    gzip_compress,
+    make_etag,
+    render_json,
+    UUID7,
+)
+
+if TYPE_CHECKING:
+    from typing import Sequence
+
+    from database.models import Artifact
+    from database.snapshot import CachedPlugin
 
 app = FastAPI()
 
@@ -41,13 +76,120 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
-rate_limit_storage = storage.RedisStorage("redis://redis_db:6379")
+# Search arguments of the listing Decky requests by default, rendered shortly after the catalog changes
+DEFAULT_CATALOG_QUERY = ("", (), False, None, SortDirection.ASC)
+# Response cache key of that listing, the only one served compressed
+DEFAULT_CATALOG_KEY = (*DEFAULT_CATALOG_QUERY, None, None)
+
+
+# Types of sort values cursors may carry for each sort type, dates are sent as ISO 8601 strings
+CURSOR_VALUE_TYPES = {SortType.NAME: str, SortType.DATE: str, SortType.DOWNLOADS: int, None: int}
+
+
+def render_catalog(
+    plugins: "Sequence[CachedPlugin]", next_cursor: "str | None" = None, compress: bool = False
+) -> "CachedResponse":
+    """
+    Renders a catalog page, compressing it only if asked to, as that's too slow for the request path.
+    """
+    body = render_json(list[api_list.ListPluginResponse], plugins)
+    # The cursor is part of the representation, so it has to be covered by the ETag too
+    etag = make_etag(body + (next_cursor or "").encode("ascii"))
+    return CachedResponse(body, etag, gzip_compress(body) if compress else None, next_cursor)
+
+
+def prerender_catalog(cache: "PluginCache") -> None:
+    # A request may have rendered it already
+    if cache.get_response(DEFAULT_CATALOG_KEY) is None:
+        page = cache.search(*DEFAULT_CATALOG_QUERY)
+        cache.store_response(cache.generation, DEFAULT_CATALOG_KEY, render_catalog(page.plugins, compress=True))
+
+
+def encode_catalog_cursor(sort_by: Optional[SortType], sort_direction: SortDirection, ranked: bool, key: tuple) -> str:
+    return encode_cursor([sort_by and sort_by.value, sort_direction.value, ranked, key])
+
+
+def decode_catalog_cursor(
+    cursor: str, sort_by: Optional[SortType], sort_direction: SortDirection, ranked: bool
+) -> tuple:
+    """
+    Turns a cursor back into the sort key it was made from, making sure it belongs to the requested ordering.
+    """
+    try:
+        cursor_sort_by, cursor_sort_direction, cursor_ranked, key = decode_cursor(cursor)
+        if [cursor_sort_by, cursor_sort_direction, cursor_ranked] != [
+            sort_by and sort_by.value,
+            sort_direction.value,
+            ranked,
+        ]:
+            raise ValueError("Cursor belongs to a different ordering")
+        if ranked:
+            in_name, in_document, name_similarity, similarity, tiebreaker = key
+            if not (
+                isinstance(in_name, bool)
+                and isinstance(in_document, bool)
+                and isinstance(name_similarity, (int, float))
+                and isinstance(similarity, (int, float))
+                and isinstance(tiebreaker, int)
+            ):
+                raise TypeError("Invalid relevance key")
+            return in_name, in_document, name_similarity, similarity, tiebreaker
+        has_value, value, plugin_id = key
+        if not isinstance(has_value, bool) or not isinstance(plugin_id, int):
+            raise TypeError("Invalid sort key")
+        if not has_value:
+            if value is not None:
+                raise TypeError("Invalid sort key")
+            return has_value, value, plugin_id
+        if not isinstance(value, CURSOR_VALUE_TYPES[sort_by]):
+            raise TypeError("Invalid sort value")
+        if sort_by == SortType.DATE and isinstance(value, str):
+            value = datetime.fromisoformat(value)
+            if value.tzinfo is None:
+                raise ValueError("Sort date has no timezone")
+        return has_value, value, plugin_id
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=fastapi.status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from e
+
+
+plugin_cache.subscribe(prerender_catalog, deferred=True)
+
 increment_limit_per_plugin = parse("2/day")
-rate_limit = strategies.FixedWindowRateLimiter(rate_limit_storage)
+rate_limit = FixedWindowRateLimiter.from_url("redis://redis_db:6379", BlockedCache(RATE_LIMIT_CACHE_BYTES))
+
+background_tasks = set()
+
+
+def remember_stored_files(cache: "PluginCache") -> None:
+    """
+    Lets the uploader skip files the catalog already references.
+    """
+    for plugin in cache.plugins:
+        uploader.stored.add(plugin.image_path)
+        uploader.stored.update(construct_version_path(version.hash) for version in plugin.versions if version.hash)
+
 
 @app.on_event("startup")
 async def startup_event():
     await fill_cache()
+    remember_stored_files(plugin_cache)
+    background_tasks.add(asyncio.create_task(flush_counters_periodically()))
+    background_tasks.add(asyncio.create_task(fold_counts_periodically()))
+    background_tasks.add(asyncio.create_task(compact_counters_periodically()))
+    background_tasks.add(asyncio.create_task(prune_stats_periodically()))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    background_tasks.clear()
+    # Write install counts reported since the last periodic flush
+    await flush_counters()
+    await rate_limit.close()
+    await uploader.close()
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: "Request", exc: "HTTPException") -> "Response":
@@ -97,9 +239,11 @@ async def create_announcement(
 
 @app.get("/v1/announcements/-/current", response_model=list[api_announcements.CurrentAnnouncementResponse])
 async def list_current_announcements(
+    request: Request,
     db: Annotated["Database", Depends(database)],
 ):
-    return await db.list_announcements()
+    body = render_json(list[api_announcements.CurrentAnnouncementResponse], await db.list_announcements())
+    return conditional_json_response(request, body, make_etag(body))
 
 
 @app.get(
@@ -145,16 +289,38 @@ async def delete_announcement(
 
 @app.get("/plugins", response_model=list[api_list.ListPluginResponse])
 async def plugins_list(
+    request: Request,
     query: str = "",
     tags: list[str] = fastapi.Query(default=[]),
     hidden: bool = False,
     sort_by: Optional[SortType] = None,
-    sort_direction: SortDirection = SortDirection.DESC,
+    sort_direction: SortDirection = SortDirection.ASC,
+    limit: Optional[int] = fastapi.Query(default=None, ge=1),
+    cursor: Optional[str] = None,
     db: "Database" = Depends(database_fake),
 ):
     tags = list(filter(None, reduce(add, (el.split(",") for el in tags), [])))
-    plugins = await db.search(query, hidden, sort_by, sort_direction)
-    return plugins
+    cache_key = (query.lower(), tuple(sorted(set(tags))), hidden, sort_by, sort_direction, limit, cursor)
+    cached = db.plugin_cache.get_response(cache_key)
+    if cached is None:
+        ranked = bool(query) and sort_by is None
+        after = decode_catalog_cursor(cursor, sort_by, sort_direction, ranked) if cursor else None
+        generation = db.plugin_cache.generation
+        page = await db.search(query, tags, hidden, sort_by, sort_direction, after, limit)
+        next_cursor = None
+        if page.next_key is not None:
+            next_cursor = encode_catalog_cursor(sort_by, sort_direction, ranked, page.next_key)
+        # The default listing is usually prerendered, a request only renders it if it was evicted or is still pending
+        cached = render_catalog(page.plugins, next_cursor, compress=cache_key == DEFAULT_CATALOG_KEY)
+        db.plugin_cache.store_response(generation, cache_key, cached)
+    return conditional_json_response(
+        request,
+        cached.body,
+        cached.etag,
+        db.plugin_cache.updated,
+        cached.gzip_body,
+        {"X-Next-Cursor": cached.next_cursor} if cached.next_cursor else None,
+    )
 
 
 @app.post("/plugins/{plugin_name}/versions/{version_name}/increment", responses={404: {}, 429: {}})
@@ -165,22 +331,101 @@ async def increment_plugin_install_count(
     isUpdate: bool = True,
     db: "Database" = Depends(database),
 ):
-    ip = getIpHash(request)
-    if not rate_limit.test(increment_limit_per_plugin, plugin_name, ip):
+    # Unknown versions are rejected before they can use up the limit
+    if db.plugin_cache.version_id(plugin_name, version_name) is None:
+        return Response(status_code=fastapi.status.HTTP_404_NOT_FOUND)
+    if not await rate_limit.hit(increment_limit_per_plugin, plugin_name, getIpHash(request)):
         return Response(status_code=fastapi.status.HTTP_429_TOO_MANY_REQUESTS)
     success = await db.increment_installs(db.session, plugin_name, version_name, isUpdate)
     if success:
-        rate_limit.hit(increment_limit_per_plugin, plugin_name, ip)
         return Response(status_code=fastapi.status.HTTP_200_OK)
     else:
         return Response(status_code=fastapi.status.HTTP_404_NOT_FOUND)
 
 
+@app.post("/plugins/-/increment", response_model=list[api_increment.InstallReportResult])
+async def increment_plugin_install_counts(
+    request: Request,
+    reports: api_increment.IncrementBatchRequest,
+    db: "Database" = Depends(database_fake),
+):
+    """
+    Counts the installs of a batch, each result carries the status the single increment endpoint would respond with.
+    """
+    statuses = [
+        (
+            fastapi.status.HTTP_404_NOT_FOUND
+            if db.plugin_cache.version_id(report.plugin, report.version) is None
+            else fastapi.status.HTTP_200_OK
+        )
+        for report in reports.__root__
+    ]
+    known = [i for i, status in enumerate(statuses) if status == fastapi.status.HTTP_200_OK]
+    ip = getIpHash(request)
+    allowed = await rate_limit.hit_many(increment_limit_per_plugin, [(reports.__root__[i].plugin, ip) for i in known])
+    for i, hit in zip(known, allowed):
+        report = reports.__root__[i]
+        if not hit:
+            statuses[i] = fastapi.status.HTTP_429_TOO_MANY_REQUESTS
+        elif not await db.increment_installs(db.session, report.plugin, report.version, report.isUpdate):
+            statuses[i] = fastapi.status.HTTP_404_NOT_FOUND
+    return [
+        api_increment.InstallReportResult(plugin=report.plugin, version=report.version, status=status)
+        for report, status in zip(reports.__root__, statuses)
+    ]
+
+
+@app.get("/plugins/{plugin_name}/stats", response_model=api_stats.PluginStatsResponse, responses={400: {}, 404: {}})
+async def plugin_stats(
+    plugin_name: str,
+    start: Optional[date] = fastapi.Query(default=None, alias="from"),
+    end: Optional[date] = fastapi.Query(default=None, alias="to"),
+    db: "Database" = Depends(database),
+):
+    plugin = db.plugin_cache.get(plugin_name)
+    if plugin is None:
+        raise HTTPException(status_code=fastapi.status.HTTP_404_NOT_FOUND, detail="Plugin not found")
+    if end is None:
+        end = datetime.now(timezone.utc).date()
+    if start is None:
+        start = end - timedelta(days=STATS_DEFAULT_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=fastapi.status.HTTP_400_BAD_REQUEST, detail="from must not be after to")
+
+    totals: "dict[date, api_stats.DailyStats]" = {}
+    versions: "dict[str, api_stats.VersionStatsResponse]" = {}
+    for version_name, day, downloads, updates in await db.get_stats(db.session, plugin.id, start, end):
+        version = versions.setdefault(version_name, api_stats.VersionStatsResponse(name=version_name, days=[]))
+        version.days.append(api_stats.DailyStats(day=day, downloads=downloads, updates=updates))
+        total = totals.setdefault(day, api_stats.DailyStats(day=day, downloads=0, updates=0))
+        total.downloads += downloads
+        total.updates += updates
+    return api_stats.PluginStatsResponse(
+        name=plugin.name,
+        start=start,
+        end=end,
+        days=sorted(totals.values(), key=lambda total: total.day),
+        versions=list(versions.values()),
+    )
+
+
 @app.post("/__auth", response_model=str, dependencies=[Depends(auth_token)])
 async def auth_check():
     return "Success"
 
 
+@app.get("/__rate_limit", dependencies=[Depends(auth_token)], response_model=api_rate_limit.RateLimitCacheResponse)
+async def rate_limit_cache_stats():
+    blocked = rate_limit.blocked
+    return api_rate_limit.RateLimitCacheResponse(
+        entries=len(blocked.entries),
+        size=blocked.size,
+        max_bytes=blocked.max_bytes,
+        hits=blocked.hits,
+        misses=blocked.misses,
+    )
+
+
 @app.post(
     "/__submit",
     dependencies=[Depends(auth_token)],
@@ -191,17 +436,18 @@ async def submit_release(
     data: "api_submit.SubmitProductRequest" = FormBody(api_submit.SubmitProductRequest),
     db: "Database" = Depends(database),
 ):
-    plugin = await db.get_plugin_by_name(db.session, data.name)
-
-    if plugin and data.force:
-        await db.delete_plugin(db.session, plugin.id)
-        plugin = None
-
-    image_path = await upload_image(data.name, data.image)
+    # Uploads don't depend on the database, they run alongside it and are cancelled if the submission fails
+    image_upload = asyncio.create_task(upload_image(data.name, data.image))
+    version_upload = asyncio.create_task(upload_version(data.file))
+    try:
+        plugin, image_path, version_data = await _prepare_release(db, data, image_upload, version_upload)
+    except BaseException:
+        image_upload.cancel()
+        version_upload.cancel()
+        await asyncio.gather(image_upload, version_upload, return_exceptions=True)
+        raise
 
     if plugin is not None:
-        if data.version_name in [i.name for i in plugin.versions]:
-            raise HTTPException(status_code=400, detail="Version already exists")
         plugin = await db.update_artifact(
             db.session,
             plugin,
@@ -220,13 +466,36 @@ async def submit_release(
             tags=list(filter(None, reduce(add, (el.split(",") for el in data.tags), []))),
         )
 
-    version = await db.insert_version(db.session, plugin.id, name=data.version_name, **await upload_version(data.file))
+    version = await db.insert_version(db.session, plugin.id, name=data.version_name, **version_data)
 
     await db.session.refresh(plugin)
     await post_announcement(plugin, version)
     return plugin
 
 
+async def _prepare_release(
+    db: "Database",
+    data: "api_submit.SubmitProductRequest",
+    image_upload: "asyncio.Task[str | None]",
+    version_upload: "asyncio.Task[dict]",
+) -> "tuple[Artifact | None, str | None, dict]":
+    """
+    Looks up the submitted plugin while its image and zip are uploaded, returns it, if it is kept, with the upload
+    results.
+    """
+    plugin = await db.get_plugin_by_name(db.session, data.name)
+
+    if plugin and data.force:
+        await db.delete_plugin(db.session, plugin.id)
+        plugin = None
+
+    if plugin is not None and data.version_name in [i.name for i in plugin.versions]:
+        raise HTTPException(status_code=400, detail="Version already exists")
+
+    image_path, version_data = await asyncio.gather(image_upload, version_upload)
+    return plugin, image_path, version_data
+
+
 @app.post("/__update", dependencies=[Depends(auth_token)], response_model=api_update.UpdatePluginResponse)
 async def update_plugin(data: "api_update.UpdatePluginRequest", db: "Database" = Depends(database)):
     old_plugin = await db.get_plugin_by_id(db.session, data.id)
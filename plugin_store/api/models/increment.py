@@ -0,0 +1,21 @@
+from pydantic import conlist
+
+from constants import INCREMENT_BATCH_SIZE
+
+from .base import BaseModel
+
+
+class InstallReport(BaseModel):
+    plugin: str
+    version: str
+    isUpdate: bool = True
+
+
+class InstallReportResult(BaseModel):
+    plugin: str
+    version: str
+    status: int
+
+
+class IncrementBatchRequest(BaseModel):
+    __root__: conlist(InstallReport, min_items=1, max_items=INCREMENT_BATCH_SIZE)  # type: ignore[valid-type]
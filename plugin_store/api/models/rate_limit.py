@@ -0,0 +1,11 @@
+from .base import BaseModel
+
+
+class RateLimitCacheResponse(BaseModel):
+    # Clients currently remembered as over their limit and the memory they take up
+    entries: int
+    size: int
+    max_bytes: int
+    # Hits were answered without calling Redis
+    hits: int
+    misses: int
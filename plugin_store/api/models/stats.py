@@ -0,0 +1,23 @@
+from datetime import date
+
+from .base import BaseModel
+
+
+class DailyStats(BaseModel):
+    day: date
+    downloads: int
+    updates: int
+
+
+class VersionStatsResponse(BaseModel):
+    name: str
+    days: list[DailyStats]
+
+
+class PluginStatsResponse(BaseModel):
+    name: str
+    start: date
+    end: date
+    # Sums over all versions
+    days: list[DailyStats]
+    versions: list[VersionStatsResponse]
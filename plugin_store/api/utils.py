@@ -1,16 +1,134 @@
+import gzip
 import inspect
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import blake2b
+from os import getenv
 from typing import Any
 
-from fastapi import File, Form, Request, UploadFile
+from fastapi import File, Form, Request, status, UploadFile
+from fastapi.encoders import jsonable_encoder
 from fastapi.params import Depends
-from pydantic import UUID1
+from fastapi.responses import JSONResponse, Response
+from pydantic import parse_obj_as, UUID1
 
 
-def getIpHash(request: Request):
+def derive_key(secret: str) -> bytes:
+    # BLAKE2b keys are at most 64 bytes, so longer secrets are hashed down to that
+    return blake2b(secret.encode("utf-8")).digest()
+
+
+rate_limit_secret = getenv("RATE_LIMIT_SECRET")
+if not rate_limit_secret:
+    raise Exception("RATE_LIMIT_SECRET not provided or invalid!")
+fingerprint_key = derive_key(rate_limit_secret)
+
+
+def fingerprint(value: str, secret: "str | None" = None) -> str:
+    """
+    Returns a compact keyed hash of the value, which is the same in every process sharing the secret.
+    """
+    key = fingerprint_key if secret is None else derive_key(secret)
+    return blake2b(value.encode("utf-8"), key=key, digest_size=16).hexdigest()
+
+
+def getIpHash(request: Request) -> str:
     ip = request.headers.get("cf-connecting-ip")
     if ip is None:
         ip = request.client.host  # type: ignore [union-attr]
-    return hash(ip)
+    return fingerprint(ip)
+
+
+def render_json(model: Any, content: Any) -> bytes:
+    """
+    Renders content the same way FastAPI would render it through ``response_model=model``.
+    """
+    return JSONResponse(jsonable_encoder(parse_obj_as(model, content))).body
+
+
+def encode_cursor(payload: Any) -> str:
+    """
+    Packs a JSON-serializable payload into an opaque, URL-safe cursor.
+    """
+    data = json.dumps(payload, separators=(",", ":"), default=lambda obj: obj.isoformat())
+    return urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Any:
+    """
+    Unpacks a cursor made by :func:`encode_cursor`, raising ``ValueError`` if it is malformed.
+    """
+    try:
+        return json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, UnicodeDecodeError) as e:
+        raise ValueError("Malformed cursor") from e
+
+
+def make_etag(body: bytes) -> str:
+    return f'"{blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def gzip_compress(body: bytes) -> "bytes | None":
+    compressed = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(compressed) >= len(body):
+        return None
+    return compressed
+
+
+def accepts_gzip(request: Request) -> bool:
+    for coding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            quality = params.strip().removeprefix("q=")
+            try:
+                return not params or float(quality) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def is_not_modified(request: Request, etag: str, last_modified: "datetime | None" = None) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since, see RFC 9110 section 13.2.2
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if last_modified is not None and if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def conditional_json_response(
+    request: Request,
+    body: bytes,
+    etag: str,
+    last_modified: "datetime | None" = None,
+    gzip_body: "bytes | None" = None,
+    extra_headers: "dict[str, str] | None" = None,
+) -> Response:
+    headers = {"Cache-Control": "no-cache", **(extra_headers or {})}
+    if gzip_body is not None:
+        headers["Vary"] = "Accept-Encoding"
+        if accepts_gzip(request):
+            # Each encoding is a separate representation, so it needs its own strong ETag
+            body, etag = gzip_body, f'{etag[:-1]}-gzip"'
+            headers["Content-Encoding"] = "gzip"
+    headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 def form_body(cls):
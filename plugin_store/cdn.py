@@ -1,16 +1,29 @@
-from asyncio import sleep
+from asyncio import create_task, gather, Lock, Semaphore, sleep
 from base64 import b64encode
+from contextlib import suppress
 from hashlib import sha1, sha256
+from json import dumps
 from logging import getLogger
 from os import getenv
-from typing import TYPE_CHECKING
+from time import monotonic
+from typing import NamedTuple, TYPE_CHECKING
 from urllib.parse import quote
 
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession
 
-from constants import CDN_ERROR_RETRY_TIMES
+from constants import (
+    CDN_AUTH_LIFETIME,
+    CDN_CHUNK_SIZE,
+    CDN_ERROR_RETRY_TIMES,
+    CDN_LARGE_FILE_SIZE,
+    CDN_PART_CONCURRENCY,
+    CDN_PART_RETRY_TIMES,
+    CDN_PART_SIZE,
+)
 
 if TYPE_CHECKING:
+    from typing import AsyncIterator, Awaitable, Callable
+
     from fastapi import UploadFile
 
 
@@ -30,59 +43,322 @@ def construct_image_path(plugin_name: str, file_hash: str, mime_type: str) -> st
     return f"artifact_images/{quote(plugin_name)}-{file_hash}{IMAGE_TYPES[mime_type]}"
 
 
-async def _b2_upload(filename: str, binary: "bytes", mime_type: str = "b2/x-auto"):
-    async with ClientSession(raise_for_status=True) as web:
-        auth_str = f"{getenv('B2_APP_KEY_ID')}:{getenv('B2_APP_KEY')}".encode("utf-8")
-        async with web.get(
-            "https://api.backblazeb2.com/b2api/v2/b2_authorize_account",
-            headers={"Authorization": f"Basic {b64encode(auth_str).decode('utf-8')}"},
+def construct_version_path(file_hash: str) -> str:
+    return f"versions/{file_hash}.zip"
+
+
+class UploadBody:
+    """
+    Contents of a file to upload, which can be read again for retries and in parts.
+
+    Besides the SHA-1 of the whole file, the SHA-1 of each ``part_size`` part is known up front, B2 needs them for
+    large file uploads.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        sha1: str,
+        part_size: int,
+        part_sha1s: "list[str]",
+        read: "Callable[[int, int], Awaitable[bytes]]",
+    ):
+        self.size = size
+        self.sha1 = sha1
+        self.part_size = part_size
+        self.part_sha1s = part_sha1s
+        self.read = read
+
+    @classmethod
+    def from_bytes(cls, binary: bytes) -> "UploadBody":
+        async def read(offset: int, size: int) -> bytes:
+            end = offset + size
+            return binary[offset:end]
+
+        part_size = CDN_PART_SIZE
+        parts = [memoryview(binary)[offset:][:part_size] for offset in range(0, len(binary), part_size)]
+        return cls(len(binary), sha1(binary).hexdigest(), part_size, [sha1(part).hexdigest() for part in parts], read)
+
+    @classmethod
+    async def from_file(cls, file: "UploadFile") -> "tuple[str, UploadBody]":
+        """
+        Hashes the file in a single pass of ``CDN_CHUNK_SIZE`` chunks, returns its SHA-256 and a body reading it again.
+        """
+        part_size = CDN_PART_SIZE
+        sha256_hash, sha1_hash, part_hash = sha256(), sha1(), sha1()
+        size, part_filled, part_sha1s = 0, 0, []
+        await file.seek(0)
+        while chunk := await file.read(CDN_CHUNK_SIZE):
+            sha256_hash.update(chunk)
+            sha1_hash.update(chunk)
+            size += len(chunk)
+            # Chunks may cross part boundaries
+            view = memoryview(chunk)
+            while view:
+                taken = min(part_size - part_filled, len(view))
+                part_hash.update(view[:taken])
+                part_filled += taken
+                view = view[taken:]
+                if part_filled == part_size:
+                    part_sha1s.append(part_hash.hexdigest())
+                    part_hash, part_filled = sha1(), 0
+        if part_filled:
+            part_sha1s.append(part_hash.hexdigest())
+
+        # Parts are read concurrently, so seeking and reading must not interleave
+        lock = Lock()
+
+        async def read(offset: int, size: int) -> bytes:
+            async with lock:
+                await file.seek(offset)
+                return await file.read(size)
+
+        return sha256_hash.hexdigest(), cls(size, sha1_hash.hexdigest(), part_size, part_sha1s, read)
+
+    def part_range(self, number: int) -> "tuple[int, int]":
+        """
+        Returns offset and length of the part with the given 1-based number.
+        """
+        offset = (number - 1) * self.part_size
+        return offset, min(self.part_size, self.size - offset)
+
+    async def chunks(self, offset: int = 0, length: "int | None" = None) -> "AsyncIterator[bytes]":
+        end = self.size if length is None else offset + length
+        while offset < end:
+            chunk = await self.read(offset, min(CDN_CHUNK_SIZE, end - offset))
+            if not chunk:
+                raise B2UploadError("File ended before its recorded size")
+            offset += len(chunk)
+            yield chunk
+
+
+class B2Authorization(NamedTuple):
+    api_url: str
+    token: str
+    expires: float
+
+
+class B2UploadUrl(NamedTuple):
+    url: str
+    token: str
+
+
+class B2Uploader:
+    """
+    Uploads files to a B2 bucket over a single HTTP session, large ones in parts.
+
+    The account authorization is kept until it expires or B2 rejects it. Upload URLs are pooled, as each one can only
+    be used by one upload at a time, concurrent uploads take different ones and put them back once done.
+    """
+
+    def __init__(
+        self,
+        key_id: "str | None",
+        key: "str | None",
+        bucket_id: "str | None",
+        api_url: str = "https://api.backblazeb2.com",
+    ):
+        self.key_id = key_id
+        self.key = key
+        self.bucket_id = bucket_id
+        self.api_url = api_url
+        self.session: "ClientSession | None" = None
+        self.authorization: "B2Authorization | None" = None
+        self.authorization_lock = Lock()
+        self.upload_urls: "list[B2UploadUrl]" = []
+        # Names of files known to be in the bucket, either uploaded by this process or referenced by the database
+        self.stored: "set[str]" = set()
+
+    def _session(self) -> "ClientSession":
+        if self.session is None or self.session.closed:
+            self.session = ClientSession()
+        return self.session
+
+    async def authorize(self, rejected: "B2Authorization | None" = None) -> "B2Authorization":
+        """
+        Returns a valid account authorization, only requesting a new one if there is none yet, it expired or it is the
+        given rejected one.
+        """
+        async with self.authorization_lock:
+            authorization = self.authorization
+            if authorization is not None and authorization != rejected and authorization.expires > monotonic():
+                return authorization
+            self.upload_urls.clear()
+            auth_str = f"{self.key_id}:{self.key}".encode("utf-8")
+            async with self._session().get(
+                f"{self.api_url}/b2api/v2/b2_authorize_account",
+                headers={"Authorization": f"Basic {b64encode(auth_str).decode('utf-8')}"},
+            ) as res:
+                if res.status != 200:
+                    getLogger().error(f"B2 LOGIN ERROR {await res.read()!r}")
+                    raise B2UploadError(await res.text())
+                res_data = await res.json()
+            self.authorization = B2Authorization(
+                res_data["apiUrl"], res_data["authorizationToken"], monotonic() + CDN_AUTH_LIFETIME
+            )
+            return self.authorization
+
+    async def _call(self, endpoint: str, payload: dict) -> dict:
+        """
+        Calls a B2 API endpoint, authorizing again once if the account authorization was rejected.
+        """
+        authorization = await self.authorize()
+        status, res_data = await self._post(authorization, endpoint, payload)
+        if status == 401:
+            authorization = await self.authorize(rejected=authorization)
+            status, res_data = await self._post(authorization, endpoint, payload)
+        if status != 200:
+            getLogger().error(f"B2 {endpoint.upper()} ERROR {res_data}")
+            raise B2UploadError(str(res_data))
+        return res_data
+
+    async def _post(self, authorization: "B2Authorization", endpoint: str, payload: dict) -> "tuple[int, dict]":
+        async with self._session().post(
+            f"{authorization.api_url}/b2api/v2/{endpoint}",
+            json=payload,
+            headers={"Authorization": authorization.token},
+        ) as res:
+            return res.status, await res.json(content_type=None)
+
+    async def _take_upload_url(self) -> "B2UploadUrl":
+        if self.upload_urls:
+            return self.upload_urls.pop()
+        return await self._new_upload_url()
+
+    async def _new_upload_url(self) -> "B2UploadUrl":
+        res_data = await self._call("b2_get_upload_url", {"bucketId": self.bucket_id})
+        return B2UploadUrl(res_data["uploadUrl"], res_data["authorizationToken"])
+
+    async def upload(self, filename: str, body: "UploadBody | bytes", mime_type: str = "b2/x-auto") -> "str | None":
+        """
+        Uploads a file, trying once more with a newly requested upload URL if the pooled one was rejected.
+
+        Files are named after a hash of their contents, so ones already known to be stored are skipped and ``None`` is
+        returned for them.
+        """
+        if filename in self.stored:
+            getLogger().info(f"Skipping upload of {filename}, it is stored already")
+            return None
+        if isinstance(body, bytes):
+            body = UploadBody.from_bytes(body)
+        if body.size > CDN_LARGE_FILE_SIZE and len(body.part_sha1s) > 1:
+            text = await self._upload_large(filename, body, mime_type)
+        else:
+            status, text = await self._upload(await self._take_upload_url(), filename, body, mime_type)
+            if status == 401:
+                # Pooled URLs may have been issued along with the rejected one, so the retry gets a new one
+                status, text = await self._upload(await self._new_upload_url(), filename, body, mime_type)
+            if status != 200:
+                raise B2UploadError(text)
+        self.stored.add(filename)
+        return text
+
+    async def _upload(
+        self, upload_url: "B2UploadUrl", filename: str, body: "UploadBody", mime_type: str
+    ) -> "tuple[int, str]":
+        async with self._session().post(
+            upload_url.url,
+            data=body.chunks(),
+            headers={
+                "Authorization": upload_url.token,
+                "Content-Type": mime_type,
+                "Content-Length": str(body.size),
+                "X-Bz-Content-Sha1": body.sha1,
+                "X-Bz-File-Name": filename,
+            },
+        ) as res:
+            if res.status == 200:
+                # B2 asks for a new upload URL after any failure, so only successful ones go back into the pool
+                self.upload_urls.append(upload_url)
+            return res.status, await res.text()
+
+    async def _upload_large(self, filename: str, body: "UploadBody", mime_type: str) -> str:
+        """
+        Uploads a file with the large file API, up to ``CDN_PART_CONCURRENCY`` of its parts at once.
+
+        Each part is tried up to ``CDN_PART_RETRY_TIMES`` times, on a new part upload URL after a failure. If a part
+        still fails, the others are cancelled along with the unfinished large file.
+        """
+        res_data = await self._call(
+            "b2_start_large_file", {"bucketId": self.bucket_id, "fileName": filename, "contentType": mime_type}
+        )
+        file_id = res_data["fileId"]
+        part_urls: "list[B2UploadUrl]" = []
+        semaphore = Semaphore(CDN_PART_CONCURRENCY)
+
+        async def upload_part(number: int) -> None:
+            async with semaphore:
+                for attempt in range(1, CDN_PART_RETRY_TIMES + 1):
+                    if part_urls:
+                        upload_url = part_urls.pop()
+                    else:
+                        res_data = await self._call("b2_get_upload_part_url", {"fileId": file_id})
+                        upload_url = B2UploadUrl(res_data["uploadUrl"], res_data["authorizationToken"])
+                    try:
+                        status, text = await self._upload_part(upload_url, body, number)
+                    except ClientError as e:
+                        status, text = None, repr(e)
+                    if status == 200:
+                        part_urls.append(upload_url)
+                        return
+                    getLogger().warning(
+                        f"B2 upload of part {number} of {filename} failed: {text} "
+                        f"(Attempt: {attempt}/{CDN_PART_RETRY_TIMES})"
+                    )
+                raise B2UploadError(text)
+
+        tasks = [create_task(upload_part(number)) for number in range(1, len(body.part_sha1s) + 1)]
+        try:
+            await gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await gather(*tasks, return_exceptions=True)
+            with suppress(B2UploadError, ClientError):
+                await self._call("b2_cancel_large_file", {"fileId": file_id})
+            raise
+        return dumps(await self._call("b2_finish_large_file", {"fileId": file_id, "partSha1Array": body.part_sha1s}))
+
+    async def _upload_part(self, upload_url: "B2UploadUrl", body: "UploadBody", number: int) -> "tuple[int, str]":
+        offset, length = body.part_range(number)
+        async with self._session().post(
+            upload_url.url,
+            data=body.chunks(offset, length),
+            headers={
+                "Authorization": upload_url.token,
+                "Content-Length": str(length),
+                "X-Bz-Content-Sha1": body.part_sha1s[number - 1],
+                "X-Bz-Part-Number": str(number),
+            },
         ) as res:
-            if not res.status == 200:
-                getLogger().error(f"B2 LOGIN ERROR {await res.read()!r}")
-                return
-            res_data = await res.json()
-
-            async with web.post(
-                f"{res_data['apiUrl']}/b2api/v2/b2_get_upload_url",
-                json={"bucketId": getenv("B2_BUCKET_ID")},
-                headers={"Authorization": res_data["authorizationToken"]},
-            ) as res_data:
-                if not res_data.status == 200:
-                    res_data.raise_for_status()
-                    return print("B2 GET_UPLOAD_URL ERROR ", await res_data.read())
-                res_data = await res_data.json()
-
-                res_data = await web.post(
-                    res_data["uploadUrl"],
-                    data=binary,
-                    headers={
-                        "Authorization": res_data["authorizationToken"],
-                        "Content-Type": mime_type,
-                        "Content-Length": str(len(binary)),
-                        "X-Bz-Content-Sha1": sha1(binary).hexdigest(),
-                        "X-Bz-File-Name": filename,
-                    },
-                )
-                t = await res_data.text()
-                if res.status == 200:
-                    return t
-                raise B2UploadError(t)
-
-
-async def b2_upload(filename: str, binary: "bytes", mime_type: str = "b2/x-auto"):
+            return res.status, await res.text()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+
+uploader = B2Uploader(getenv("B2_APP_KEY_ID"), getenv("B2_APP_KEY"), getenv("B2_BUCKET_ID"))
+
+
+async def b2_upload(filename: str, body: "UploadBody | bytes", mime_type: str = "b2/x-auto"):
+    """
+    Uploads a file, retrying failed uploads. Raises the last :class:`B2UploadError` once retries are exhausted, so
+    nothing refers to a file which isn't stored.
+    """
     attempt = 1
     while True:
         try:
-            return await _b2_upload(filename, binary, mime_type)
+            return await uploader.upload(filename, body, mime_type)
         except B2UploadError as e:
+            if attempt == CDN_ERROR_RETRY_TIMES:
+                getLogger().error(f"B2 Upload Failed: {e}. Retried upload {CDN_ERROR_RETRY_TIMES} times. Aborting...")
+                raise
             getLogger().error(
                 f"B2 Upload Failed: {e}. Retrying in {attempt * 5} seconds (Attempt: {attempt}/{CDN_ERROR_RETRY_TIMES})"
             )
             await sleep(attempt * 5)
             attempt += 1
-            if attempt == CDN_ERROR_RETRY_TIMES + 1:
-                getLogger().error(f"Retried upload {CDN_ERROR_RETRY_TIMES} times. Aborting...")
-                return
 
 
 async def fetch_image(image_url: str) -> "tuple[bytes, str] | None":
@@ -105,9 +381,8 @@ async def upload_image(plugin_name: str, image_url: str) -> "str | None":
 
 
 async def upload_version(file: "UploadFile"):
-    binary = await file.read()
-    file_hash = sha256(binary).hexdigest()
-    await b2_upload(f"versions/{file_hash}.zip", binary)
+    file_hash, body = await UploadBody.from_file(file)
+    await b2_upload(construct_version_path(file_hash), body)
     return {
         "hash": file_hash,
     }
@@ -1,4 +1,5 @@
 from enum import Enum
+from os import getenv
 from pathlib import Path
 
 BASE_DIR = Path(__file__).expanduser().resolve().parent
@@ -6,6 +7,42 @@ TEMPLATES_DIR = BASE_DIR / "templates"
 
 CDN_URL = "https://cdn.tzatzikiweeb.moe/file/steam-deck-homebrew/"
 CDN_ERROR_RETRY_TIMES = 5
+# Bytes read at once when hashing and streaming uploaded files
+CDN_CHUNK_SIZE = 1024 * 1024
+# Seconds a B2 account authorization is reused for, B2 accepts it for 24 hours
+CDN_AUTH_LIFETIME = 23 * 60 * 60
+# Files over this many bytes are uploaded in parts of CDN_PART_SIZE bytes, B2 needs parts of at least 5 MB
+CDN_LARGE_FILE_SIZE = 64 * 1024 * 1024
+CDN_PART_SIZE = 16 * 1024 * 1024
+# Parts of a large file uploaded at once, and times a failed part is uploaded again
+CDN_PART_CONCURRENCY = 4
+CDN_PART_RETRY_TIMES = 3
+
+PLUGIN_RESPONSE_CACHE_SIZE = 256
+PLUGIN_CACHE_LOAD_CHUNK_SIZE = 500
+# Seconds after a catalog change the default listing is rendered, changes in between are rendered together
+PLUGIN_PRERENDER_DELAY = 1
+
+# Seconds between writes of buffered install counts
+COUNTER_FLUSH_INTERVAL = 5
+# Slots install counts of a version are spread over before being compacted into it, 0 writes them to it directly
+COUNTER_SHARDS = int(getenv("COUNTER_SHARDS", "0"))
+# Seconds between compactions of sharded install counts
+COUNTER_COMPACT_INTERVAL = 60
+# Seconds between adding flushed install counts to the cached catalog, which renders it again and changes its ETag
+COUNTER_FOLD_INTERVAL = 10 * 60
+
+# Days daily install counts are kept for, and seconds between removing older ones
+STATS_RETENTION_DAYS = 400
+STATS_PRUNE_INTERVAL = 60 * 60
+# Days of daily install counts returned if no range is requested
+STATS_DEFAULT_DAYS = 30
+
+# Most installs a single batch report may contain
+INCREMENT_BATCH_SIZE = 100
+
+# Memory the in-process cache of clients over their rate limit may take up
+RATE_LIMIT_CACHE_BYTES = 4 * 1024 * 1024
 
 
 class SortDirection(Enum):
@@ -0,0 +1,142 @@
+from asyncio import get_running_loop
+from typing import NamedTuple, Optional, TYPE_CHECKING
+
+from constants import PLUGIN_PRERENDER_DELAY, PLUGIN_RESPONSE_CACHE_SIZE, SortDirection, SortType
+
+from .counters import add_counts
+from .snapshot import CatalogSnapshot
+
+if TYPE_CHECKING:
+    from asyncio import TimerHandle
+    from datetime import datetime
+    from typing import Callable, Hashable, Iterable, Sequence
+
+    from .counters import Counts
+    from .models.Artifact import Artifact
+    from .snapshot import CachedPlugin, SearchPage
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    gzip_body: "bytes | None" = None
+    next_cursor: "str | None" = None
+
+
+class PluginCache:
+    """
+    In-process snapshot of the plugin catalog.
+
+    Every rebuild swaps in a new :class:`CatalogSnapshot` with a bumped ``generation``, which invalidates all serialized
+    responses stored for the previous one, and then notifies subscribers so they can pre-render responses for it.
+
+    Deferred subscribers are notified ``PLUGIN_PRERENDER_DELAY`` seconds after a swap instead, once for all swaps in
+    that time, so slow pre-rendering neither runs inside the write which made the swap nor once per write of a burst.
+    """
+
+    def __init__(self):
+        self.snapshot = CatalogSnapshot()
+        self.subscribers: "list[Callable[[PluginCache], None]]" = []
+        self.deferred_subscribers: "list[Callable[[PluginCache], None]]" = []
+        self.deferred_notification: "TimerHandle | None" = None
+        # Flushed install counts by version id which aren't part of the snapshot yet
+        self.unfolded_counts: "dict[int, Counts]" = {}
+
+    @property
+    def plugins(self) -> "Sequence[CachedPlugin]":
+        return self.snapshot.plugins
+
+    @property
+    def generation(self) -> int:
+        return self.snapshot.generation
+
+    @property
+    def updated(self) -> "datetime":
+        return self.snapshot.created
+
+    def subscribe(self, subscriber: "Callable[[PluginCache], None]", deferred: bool = False) -> None:
+        (self.deferred_subscribers if deferred else self.subscribers).append(subscriber)
+
+    def _swap(self, snapshot: "CatalogSnapshot") -> None:
+        self.snapshot = snapshot
+        for subscriber in self.subscribers:
+            subscriber(self)
+        if self.deferred_subscribers and self.deferred_notification is None:
+            self.deferred_notification = get_running_loop().call_later(PLUGIN_PRERENDER_DELAY, self._notify_deferred)
+
+    def _notify_deferred(self) -> None:
+        self.deferred_notification = None
+        for subscriber in self.deferred_subscribers:
+            subscriber(self)
+
+    def replace(self, plugins: "Iterable[CachedPlugin]", counts: "dict[int, Counts] | None" = None) -> None:
+        """
+        Replaces the whole catalog, adding counts which weren't compacted into the versions yet.
+
+        Plugins are loaded after their flushed counts were written, so unfolded counts are dropped.
+        """
+        snapshot = CatalogSnapshot(plugins, self.snapshot.generation + 1)
+        self.unfolded_counts.clear()
+        self._swap(snapshot.with_counts(counts) if counts else snapshot)
+
+    def upsert(self, plugin: "Artifact", counts: "dict[int, Counts] | None" = None) -> None:
+        for version in plugin.versions:
+            if version.id is not None:
+                self.unfolded_counts.pop(version.id, None)
+        self._swap(self.snapshot.with_plugin(plugin, counts))
+
+    def evict(self, plugin_id: int) -> None:
+        self._swap(self.snapshot.without_plugin(plugin_id))
+
+    def add_counts(self, counts: "dict[int, Counts]") -> None:
+        """
+        Remembers flushed install counts until :meth:`fold_counts` adds them to the catalog.
+
+        Every swap renders the catalog again and changes its validators, so counts aren't folded in on every flush.
+        """
+        for version_id, added in counts.items():
+            add_counts(self.unfolded_counts, version_id, added)
+
+    def fold_counts(self) -> None:
+        if self.unfolded_counts:
+            counts, self.unfolded_counts = self.unfolded_counts, {}
+            self._swap(self.snapshot.with_counts(counts))
+
+    def get(self, name: str) -> "CachedPlugin | None":
+        return self.snapshot.get(name)
+
+    def version_id(self, plugin_name: str, version_name: str) -> "int | None":
+        return self.snapshot.version_ids.get((plugin_name, version_name))
+
+    def search(
+        self,
+        name: "str | None" = "",
+        tags: "Iterable[str] | None" = None,
+        include_hidden: "bool" = False,
+        sort_by: Optional[SortType] = None,
+        sort_direction: SortDirection = SortDirection.ASC,
+        after: "tuple | None" = None,
+        limit: "int | None" = None,
+    ) -> "SearchPage":
+        return self.snapshot.search(name, tags, include_hidden, sort_by, sort_direction, after, limit)
+
+    def get_response(self, key: "Hashable") -> "CachedResponse | None":
+        responses = self.snapshot.responses
+        response = responses.get(key)
+        if response is not None:
+            responses.move_to_end(key)
+        return response
+
+    def store_response(self, generation: int, key: "Hashable", response: "CachedResponse") -> None:
+        """
+        Stores a rendered response, evicting the least recently used one once ``PLUGIN_RESPONSE_CACHE_SIZE`` are
+        stored, so one-off queries can't crowd out popular ones for the rest of the generation.
+        """
+        snapshot = self.snapshot
+        # Don't store bodies rendered from an older snapshot
+        if generation != snapshot.generation:
+            return
+        snapshot.responses[key] = response
+        snapshot.responses.move_to_end(key)
+        while len(snapshot.responses) > PLUGIN_RESPONSE_CACHE_SIZE:
+            snapshot.responses.popitem(last=False)
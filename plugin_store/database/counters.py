@@ -0,0 +1,42 @@
+from typing import NamedTuple
+
+
+class Counts(NamedTuple):
+    downloads: int = 0
+    updates: int = 0
+
+
+def add_counts(totals: "dict[int, Counts]", version_id: int, counts: "Counts") -> None:
+    downloads, updates = totals.get(version_id, Counts())
+    totals[version_id] = Counts(downloads + counts.downloads, updates + counts.updates)
+
+
+class CounterBuffer:
+    """
+    Install and update counts which were reported but not written to the database yet, keyed by version id.
+    """
+
+    def __init__(self):
+        self.pending: "dict[int, Counts]" = {}
+
+    def add(self, version_id: int, isUpdate: bool) -> None:
+        downloads, updates = self.pending.get(version_id, Counts())
+        if isUpdate:
+            updates += 1
+        else:
+            downloads += 1
+        self.pending[version_id] = Counts(downloads, updates)
+
+    def take(self) -> "dict[int, Counts]":
+        """
+        Hands over all pending counts, new ones are collected from scratch.
+        """
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def restore(self, counts: "dict[int, Counts]") -> None:
+        """
+        Puts back counts which couldn't be written, so they are retried with the next flush.
+        """
+        for version_id, added in counts.items():
+            add_counts(self.pending, version_id, added)
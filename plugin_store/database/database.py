@@ -1,7 +1,8 @@
 import logging
-from asyncio import Lock
-from datetime import datetime
+from asyncio import Lock, shield, sleep
+from datetime import date, datetime, timedelta
 from os import getenv
+from random import randrange
 from typing import Optional, TYPE_CHECKING
 from uuid import UUID
 from zoneinfo import ZoneInfo
@@ -11,20 +12,40 @@ from alembic import command
 from alembic.config import Config
 from asgiref.sync import sync_to_async
 from fastapi import Depends
-from sqlalchemy import asc, desc
-from sqlalchemy.exc import NoResultFound, SQLAlchemyError
+from sqlalchemy import asc, desc, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, NoResultFound, SQLAlchemyError
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession, create_async_engine
-from sqlalchemy.sql import delete, select, update
+from sqlalchemy.sql import bindparam, delete, select, update
 
-from constants import SortDirection, SortType
+from constants import (
+    COUNTER_COMPACT_INTERVAL,
+    COUNTER_FLUSH_INTERVAL,
+    COUNTER_FOLD_INTERVAL,
+    COUNTER_SHARDS,
+    PLUGIN_CACHE_LOAD_CHUNK_SIZE,
+    SortDirection,
+    SortType,
+    STATS_PRUNE_INTERVAL,
+    STATS_RETENTION_DAYS,
+)
 
+from .cache import PluginCache
+from .counters import add_counts, CounterBuffer, Counts
 from .models.announcements import Announcement
-from .models.Artifact import Artifact, PluginTag, Tag
+from .models.Artifact import Artifact, PluginTag, Tag, update_aggregates
 from .models.Version import Version
+from .models.VersionCounterShard import VersionCounterShard
+from .models.VersionStats import VersionStats
+from .snapshot import CachedPlugin
 
 if TYPE_CHECKING:
     from typing import AsyncIterator, Iterable, Sequence
 
+    from sqlalchemy import Row, Table
+
+    from .snapshot import CachedTag, SearchPage
+
 logger = logging.getLogger()
 
 UTC = ZoneInfo("UTC")
@@ -40,8 +61,8 @@ async_engine = create_async_engine(
 AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, future=True, expire_on_commit=False)
 
 db_lock = Lock()
-plugin_cache = []
-last_time = 0
+plugin_cache = PluginCache()
+counter_buffer = CounterBuffer()
 
 async def get_session() -> "AsyncIterator[AsyncSession]":
     try:
@@ -50,7 +71,7 @@ async def get_session() -> "AsyncIterator[AsyncSession]":
         logger.exception(e)
 
 async def database(session: "AsyncSession" = Depends(get_session)) -> "AsyncIterator[Database]":
-    db = Database(session, db_lock, plugin_cache)
+    db = Database(session, db_lock, plugin_cache, counter_buffer)
     try:
         yield db
     except Exception:
@@ -60,22 +81,72 @@ async def database(session: "AsyncSession" = Depends(get_session)) -> "AsyncIter
         await session.close()
 
 async def database_fake() -> "AsyncIterator[Database]":
-    db = Database(None, db_lock, plugin_cache)
+    db = Database(None, db_lock, plugin_cache, counter_buffer)
     try:
         yield db
     except Exception:
         raise
 
 async def fill_cache():
-    db = Database(AsyncSessionLocal(), db_lock, plugin_cache)
+    db = Database(AsyncSessionLocal(), db_lock, plugin_cache, counter_buffer)
     await db.update_cache(db.session)
     await db.session.close()
 
+
+async def flush_counters():
+    db = Database(AsyncSessionLocal(), db_lock, plugin_cache, counter_buffer)
+    try:
+        await db.flush_counters(db.session)
+    finally:
+        await db.session.close()
+
+
+async def flush_counters_periodically():
+    while True:
+        await sleep(COUNTER_FLUSH_INTERVAL)
+        try:
+            # Shutdown cancels this task, but a flush which already took counts has to write them
+            await shield(flush_counters())
+        except Exception as e:
+            logger.exception(e)
+
+
+async def fold_counts_periodically():
+    while True:
+        await sleep(COUNTER_FOLD_INTERVAL)
+        plugin_cache.fold_counts()
+
+
+async def compact_counters_periodically():
+    while True:
+        await sleep(COUNTER_COMPACT_INTERVAL)
+        db = Database(AsyncSessionLocal(), db_lock, plugin_cache, counter_buffer)
+        try:
+            await db.compact_counters(db.session)
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            await db.session.close()
+
+
+async def prune_stats_periodically():
+    while True:
+        db = Database(AsyncSessionLocal(), db_lock, plugin_cache, counter_buffer)
+        try:
+            await db.prune_stats(db.session, datetime.now(UTC).date() - timedelta(days=STATS_RETENTION_DAYS))
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            await db.session.close()
+        await sleep(STATS_PRUNE_INTERVAL)
+
+
 class Database:
-    def __init__(self, session, lock, plugin_cache):
+    def __init__(self, session, lock, plugin_cache: "PluginCache", counters: "CounterBuffer"):
         self.session = session
         self.lock = lock
-        self.plugin_cache: list = plugin_cache
+        self.plugin_cache = plugin_cache
+        self.counters = counters
 
     @sync_to_async()
     def init(self):
@@ -179,7 +250,7 @@ class Database:
                 await nested.rollback()
                 raise
             await session.commit()
-            await self.update_cache(session)
+            await self.refresh_cached_plugin(session, plugin.id)
             return await self.get_plugin_by_id(session, plugin.id)
 
     async def update_artifact(self, session: "AsyncSession", plugin: "Artifact", **kwargs) -> "Artifact":
@@ -199,7 +270,7 @@ class Database:
                 await nested.rollback()
                 raise
             await session.commit()
-        await self.update_cache(session)
+            await self.refresh_cached_plugin(session, plugin.id)
         return await self.get_plugin_by_id(session, plugin.id)
 
     async def insert_version(
@@ -214,6 +285,7 @@ class Database:
         async with self.lock:
             session.add(version)
             await session.commit()
+            await self.refresh_cached_plugin(session, artifact_id)
         return version
 
     async def _search(
@@ -253,20 +325,52 @@ class Database:
         result = (await session.execute(statement)).scalars().all()
         return result or []
     
-    async def update_cache(self, session):
-        self.plugin_cache.clear()
-        self.plugin_cache.extend(await self._search(session, limit=500, include_hidden=True))
+    async def _iter_artifacts(self, session: "AsyncSession") -> "AsyncIterator[Artifact]":
+        """
+        Yields all artifacts ordered by id, loading them in bounded keyset-paginated chunks.
+        """
+        last_id = None
+        while True:
+            statement = select(Artifact).order_by(Artifact.id).limit(PLUGIN_CACHE_LOAD_CHUNK_SIZE)
+            if last_id is not None:
+                statement = statement.where(Artifact.id > last_id)
+            chunk = (await session.execute(statement)).scalars().all()
+            for artifact in chunk:
+                yield artifact
+            if len(chunk) < PLUGIN_CACHE_LOAD_CHUNK_SIZE:
+                return
+            last_id = chunk[-1].id
+
+    async def update_cache(self, session: "AsyncSession") -> None:
+        start = time()
+        # Only the compact records are kept, artifacts of finished chunks can be garbage collected right away
+        tags: "dict[str, CachedTag]" = {}
+        plugins = [CachedPlugin.from_orm(artifact, tags) async for artifact in self._iter_artifacts(session)]
+        self.plugin_cache.replace(plugins, await self._sharded_counts(session))
+        logger.info(f"Loaded {len(plugins)} plugins into the cache in {time() - start:.3f}s")
     
+    async def refresh_cached_plugin(self, session: "AsyncSession", id: int) -> None:
+        """
+        Reloads a single artifact into the plugin cache, or drops it from there if it no longer exists.
+        """
+        statement = select(Artifact).where(Artifact.id == id).execution_options(populate_existing=True)
+        plugin = (await session.execute(statement)).scalars().first()
+        if plugin is None:
+            self.plugin_cache.evict(id)
+        else:
+            self.plugin_cache.upsert(plugin, await self._sharded_counts(session, id))
+
     async def search(
         self,
         name: "str | None" = "",
+        tags: "Iterable[str] | None" = None,
         include_hidden: "bool" = False,
         sort_by: Optional[SortType] = None,
-        sort_direction: SortDirection = SortDirection.DESC
-    ) -> "Sequence[Artifact]":
-        sort_key = {SortType.NAME: "name", SortType.DOWNLOADS: "downloads", SortType.DATE: "created", "id": "id"}[sort_by or "id"]
-        return sorted([i for i in self.plugin_cache if i.visible is not include_hidden and name.lower() in i.name.lower()],
-                      key=lambda x: getattr(x, sort_key), reverse=sort_direction==SortDirection.ASC)
+        sort_direction: SortDirection = SortDirection.ASC,
+        after: "tuple | None" = None,
+        limit: "int | None" = None,
+    ) -> "SearchPage":
+        return self.plugin_cache.search(name, tags, include_hidden, sort_by, sort_direction, after, limit)
 
     async def get_plugin_by_name(self, session: "AsyncSession", name: str) -> "Artifact | None":
         statement = select(Artifact).where(Artifact.name == name)
@@ -281,27 +385,181 @@ class Database:
 
     async def delete_plugin(self, session: "AsyncSession", id: int):
         await session.execute(delete(PluginTag).where(PluginTag.c.artifact_id == id))
+        versions = select(Version.id).where(Version.artifact_id == id)
+        await session.execute(delete(VersionStats).where(VersionStats.version_id.in_(versions)))
+        await session.execute(delete(VersionCounterShard).where(VersionCounterShard.version_id.in_(versions)))
         await session.execute(delete(Version).where(Version.artifact_id == id))
         await session.execute(delete(Artifact).where(Artifact.id == id))
         r = await session.commit()
-        await self.update_cache(session)
+        self.plugin_cache.evict(id)
         return r
 
     async def increment_installs(
         self, session: "AsyncSession", plugin_name: str, version_name: str, isUpdate: bool
     ) -> bool:
-        statement = update(Version)
-        if isUpdate:
-            statement = statement.values(updates=Version.updates + 1)
-        else:
-            statement = statement.values(downloads=Version.downloads + 1)
-        plugin_id = (await session.execute(select(Artifact.id).where(Artifact.name == plugin_name))).scalar()
-        if plugin_id is None:
+        """
+        Counts an install of the given version, returns ``False`` if there is no such version.
+
+        The version is looked up in the plugin cache and the count is only buffered, :meth:`flush_counters` writes
+        it to the database later.
+        """
+        version_id = self.plugin_cache.version_id(plugin_name, version_name)
+        if version_id is None:
             return False
-        r = await session.execute(statement.where((Version.name == version_name) & (Version.artifact_id == plugin_id)))
+        self.counters.add(version_id, isUpdate)
+        return True
+
+    async def flush_counters(self, session: "AsyncSession") -> None:
+        """
+        Writes all buffered install counts in a single batched statement together with the affected artifacts'
+        aggregates and today's daily stats, then hands them to the plugin cache, which folds them in periodically.
+
+        With ``COUNTER_SHARDS`` set, counts are added to a random slot of each version instead, which
+        :meth:`compact_counters` moves into the versions later. Concurrent flushes of other processes then rarely
+        wait on each other's row locks.
+
+        Holding the lock keeps artifacts reloaded by concurrent writes from counting the same installs twice. Counts
+        are only taken once it's held, so a flush waiting for another one also waits until that one wrote its counts.
+
+        Counts of versions deleted since they were reported are dropped, stats and shards can't refer to them.
+        """
+        async with self.lock:
+            pending = self.counters.take()
+            if not pending:
+                return
+            try:
+                try:
+                    written = await self._write_counts(session, pending)
+                except IntegrityError:
+                    # A version was deleted between looking it up and writing its counts, looking up again skips it
+                    await session.rollback()
+                    logger.warning(f"Retrying install counts of {len(pending)} versions after a concurrent delete")
+                    written = await self._write_counts(session, pending)
+            except Exception:
+                await session.rollback()
+                self.counters.restore(pending)
+                raise
+            if written:
+                self.plugin_cache.add_counts(written)
+
+    async def _write_counts(self, session: "AsyncSession", pending: "dict[int, Counts]") -> "dict[int, Counts]":
+        """
+        Writes the counts of versions which still exist and commits them, returns the written counts.
+        """
+        existing = set(await session.scalars(select(Version.id).where(Version.id.in_(pending))))
+        pending = {version_id: counts for version_id, counts in pending.items() if version_id in existing}
+        if not pending:
+            return pending
+        if COUNTER_SHARDS:
+            await session.execute(
+                self._add_counts(session, VersionCounterShard.__table__, "version_id", "slot"),
+                [
+                    {
+                        "version_id": version_id,
+                        "slot": randrange(COUNTER_SHARDS),
+                        "downloads": downloads,
+                        "updates": updates,
+                    }
+                    for version_id, (downloads, updates) in pending.items()
+                ],
+            )
+        else:
+            await self._add_to_versions(session, pending)
+        today = datetime.now(UTC).date()
+        await session.execute(
+            self._add_counts(session, VersionStats.__table__, "version_id", "day"),
+            [
+                {"version_id": version_id, "day": today, "downloads": downloads, "updates": updates}
+                for version_id, (downloads, updates) in pending.items()
+            ],
+        )
+        await session.commit()
+        return pending
+
+    async def compact_counters(self, session: "AsyncSession") -> None:
+        """
+        Moves sharded install counts into their versions and the affected artifacts' aggregates.
+
+        The cache already includes them, so it stays untouched.
+        """
+        table = VersionCounterShard.__table__
+        statement = delete(table).returning(table.c.version_id, table.c.downloads, table.c.updates)
+        async with self.lock:
+            try:
+                counts: "dict[int, Counts]" = {}
+                for version_id, downloads, updates in await session.execute(statement):
+                    add_counts(counts, version_id, Counts(downloads, updates))
+                if counts:
+                    await self._add_to_versions(session, counts)
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    async def _add_to_versions(self, session: "AsyncSession", counts: "dict[int, Counts]") -> None:
+        statement = (
+            update(Version.__table__)
+            .where(Version.id == bindparam("version_id"))
+            .values(
+                downloads=Version.downloads + bindparam("new_downloads"),
+                updates=Version.updates + bindparam("new_updates"),
+            )
+        )
+        await session.execute(
+            statement,
+            [
+                {"version_id": version_id, "new_downloads": downloads, "new_updates": updates}
+                for version_id, (downloads, updates) in counts.items()
+            ],
+        )
+        artifact_ids = select(Version.artifact_id).where(Version.id.in_(counts))
+        await session.execute(update_aggregates(Artifact.id.in_(artifact_ids)))
+
+    async def _sharded_counts(self, session: "AsyncSession", artifact_id: "int | None" = None) -> "dict[int, Counts]":
+        """
+        Returns install counts not compacted into versions yet, optionally only the ones of a single artifact.
+        """
+        statement = select(
+            VersionCounterShard.version_id,
+            func.sum(VersionCounterShard.downloads),
+            func.sum(VersionCounterShard.updates),
+        ).group_by(VersionCounterShard.version_id)
+        if artifact_id is not None:
+            statement = statement.join(Version, Version.id == VersionCounterShard.version_id).where(
+                Version.artifact_id == artifact_id
+            )
+        rows = await session.execute(statement)
+        return {version_id: Counts(downloads, updates) for version_id, downloads, updates in rows}
+
+    @staticmethod
+    def _add_counts(session: "AsyncSession", table: "Table", *key: str):
+        """
+        Returns a statement adding counts to the row with the given key, creating it if needed.
+        """
+        dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=list(key),
+            set_={
+                "downloads": table.c.downloads + statement.excluded.downloads,
+                "updates": table.c.updates + statement.excluded.updates,
+            },
+        )
+
+    async def get_stats(
+        self, session: "AsyncSession", plugin_id: int, start: "date", end: "date"
+    ) -> "Sequence[Row[tuple[str | None, date | None, int | None, int | None]]]":
+        """
+        Returns version names with their daily install counts between both days inclusively, ordered by version and day.
+        """
+        statement = (
+            select(Version.name, VersionStats.day, VersionStats.downloads, VersionStats.updates)
+            .join(Version, Version.id == VersionStats.version_id)
+            .where((Version.artifact_id == plugin_id) & (VersionStats.day >= start) & (VersionStats.day <= end))
+            .order_by(Version.id, VersionStats.day)
+        )
+        return (await session.execute(statement)).all()
+
+    async def prune_stats(self, session: "AsyncSession", before: "date") -> None:
+        await session.execute(delete(VersionStats).where(VersionStats.day < before))
         await session.commit()
-        # if rowcount is zero then the version wasn't found
-        v = r.rowcount == 1  # type: ignore[attr-defined]
-#        if v:
-#            await self.update_cache(session)
-        return v
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""materialize artifact aggregates
+
+Revision ID: e84ff988ed8a
+Revises: 469f48c143b9
+Create Date: 2026-10-17 18:00:12.418035
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from database import utils
+
+# revision identifiers, used by Alembic.
+revision = "e84ff988ed8a"
+down_revision = "469f48c143b9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("artifacts", sa.Column("downloads", sa.Integer(), nullable=True))
+    op.add_column("artifacts", sa.Column("updates", sa.Integer(), nullable=True))
+    op.add_column("artifacts", sa.Column("created", utils.TZDateTime(), nullable=True))
+    op.add_column("artifacts", sa.Column("updated", utils.TZDateTime(), nullable=True))
+    op.execute(
+        """
+        UPDATE artifacts SET
+            downloads = (SELECT sum(versions.downloads) FROM versions WHERE versions.artifact_id = artifacts.id),
+            updates = (SELECT sum(versions.updates) FROM versions WHERE versions.artifact_id = artifacts.id),
+            created = (SELECT min(versions.added_on) FROM versions WHERE versions.artifact_id = artifacts.id),
+            updated = (SELECT max(versions.added_on) FROM versions WHERE versions.artifact_id = artifacts.id)
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("artifacts", "updated")
+    op.drop_column("artifacts", "created")
+    op.drop_column("artifacts", "updates")
+    op.drop_column("artifacts", "downloads")
@@ -0,0 +1,32 @@
+"""add daily version stats
+
+Revision ID: ef016ad3ae15
+Revises: e84ff988ed8a
+Create Date: 2026-10-17 18:30:41.207653
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "ef016ad3ae15"
+down_revision = "e84ff988ed8a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "version_stats",
+        sa.Column("version_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("downloads", sa.Integer(), nullable=False),
+        sa.Column("updates", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["version_id"], ["versions.id"]),
+        sa.PrimaryKeyConstraint("version_id", "day"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("version_stats")
@@ -0,0 +1,32 @@
+"""add sharded version counters
+
+Revision ID: 7c98166eb095
+Revises: ef016ad3ae15
+Create Date: 2026-10-17 19:00:27.931604
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7c98166eb095"
+down_revision = "ef016ad3ae15"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "version_counter_shards",
+        sa.Column("version_id", sa.Integer(), nullable=False),
+        sa.Column("slot", sa.Integer(), nullable=False),
+        sa.Column("downloads", sa.Integer(), nullable=False),
+        sa.Column("updates", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["version_id"], ["versions.id"]),
+        sa.PrimaryKeyConstraint("version_id", "slot"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("version_counter_shards")
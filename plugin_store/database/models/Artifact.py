@@ -1,14 +1,20 @@
 from datetime import datetime
+from typing import TYPE_CHECKING
 from urllib.parse import quote
 
-from sqlalchemy import Boolean, Column, ForeignKey, func, Integer, select, Table, Text, UniqueConstraint
-from sqlalchemy.orm import column_property, Mapped, relationship
+from sqlalchemy import Boolean, Column, event, ForeignKey, func, Integer, select, Table, Text, UniqueConstraint, update
+from sqlalchemy.orm import Mapped, relationship
 
 import constants
 
+from ..utils import TZDateTime
 from .Base import Base
 from .Version import Version
 
+if TYPE_CHECKING:
+    from sqlalchemy import ColumnElement, Connection, Update
+    from sqlalchemy.orm import Mapper
+
 
 class Tag(Base):
     __tablename__ = "tags"
@@ -42,20 +48,11 @@ class Artifact(Base):
     )
     visible: Mapped[bool] = Column(Boolean, default=True)
 
-    # Properties computed from relations
-    downloads: Mapped[int] = column_property(
-        select(func.sum(Version.downloads)).where(Version.artifact_id == id).correlate_except(Version).scalar_subquery()
-    )
-    updates: Mapped[int] = column_property(
-        select(func.sum(Version.updates)).where(Version.artifact_id == id).correlate_except(Version).scalar_subquery()
-    )
-
-    created: Mapped[datetime] = column_property(
-        select(func.min(Version.created)).where(Version.artifact_id == id).correlate_except(Version).scalar_subquery()
-    )
-    updated: Mapped[datetime] = column_property(
-        select(func.max(Version.created)).where(Version.artifact_id == id).correlate_except(Version).scalar_subquery()
-    )
+    # Aggregates of versions, kept current by :func:`update_aggregates`
+    downloads: Mapped[int | None] = Column(Integer, nullable=True)
+    updates: Mapped[int | None] = Column(Integer, nullable=True)
+    created: Mapped[datetime | None] = Column(TZDateTime, nullable=True)
+    updated: Mapped[datetime | None] = Column(TZDateTime, nullable=True)
 
     UniqueConstraint("name")
 
@@ -68,3 +65,31 @@ class Artifact(Base):
         if self._image_path is not None:
             return self._image_path
         return f"artifact_images/{quote(self.name)}.png"
+
+
+def update_aggregates(where: "ColumnElement[bool]") -> "Update":
+    """
+    Returns a statement recomputing the version aggregates of artifacts matching the given condition.
+    """
+
+    def aggregate(function):
+        return select(function).where(Version.artifact_id == Artifact.id).scalar_subquery()
+
+    return (
+        update(Artifact)
+        .where(where)
+        .values(
+            downloads=aggregate(func.sum(Version.downloads)),
+            updates=aggregate(func.sum(Version.updates)),
+            created=aggregate(func.min(Version.created)),
+            updated=aggregate(func.max(Version.created)),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+@event.listens_for(Version, "after_insert")
+@event.listens_for(Version, "after_update")
+@event.listens_for(Version, "after_delete")
+def update_artifact_aggregates(mapper: "Mapper", connection: "Connection", version: "Version") -> None:
+    connection.execute(update_aggregates(Artifact.id == version.artifact_id))
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, ForeignKey, Integer
+
+from .Base import Base
+
+
+class VersionCounterShard(Base):
+    """
+    Install counts of a version not yet compacted into it, spread over slots so concurrent writers rarely share a row.
+    """
+
+    __tablename__ = "version_counter_shards"
+
+    version_id = Column(Integer, ForeignKey("versions.id"), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    downloads = Column(Integer, default=0, nullable=False)
+    updates = Column(Integer, default=0, nullable=False)
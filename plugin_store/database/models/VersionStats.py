@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Date, ForeignKey, Integer
+
+from .Base import Base
+
+
+class VersionStats(Base):
+    """
+    Installs of a version counted on a single day (UTC).
+    """
+
+    __tablename__ = "version_stats"
+
+    version_id = Column(Integer, ForeignKey("versions.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    downloads = Column(Integer, default=0, nullable=False)
+    updates = Column(Integer, default=0, nullable=False)
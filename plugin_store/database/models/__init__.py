@@ -2,6 +2,8 @@ from .announcements import Announcement
 from .Artifact import Artifact, PluginTag, Tag
 from .Base import Base
 from .Version import Version
+from .VersionCounterShard import VersionCounterShard
+from .VersionStats import VersionStats
 
 __all__ = [
     "Announcement",
@@ -10,4 +12,6 @@ __all__ = [
     "PluginTag",
     "Tag",
     "Version",
+    "VersionCounterShard",
+    "VersionStats",
 ]
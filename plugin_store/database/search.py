@@ -0,0 +1,157 @@
+import re
+from typing import NamedTuple, TYPE_CHECKING, TypeVar
+
+if TYPE_CHECKING:
+    from typing import Iterable, Sequence
+
+    from .snapshot import CachedPlugin
+
+T = TypeVar("T")
+
+# Share of a query word's trigrams a plugin has to contain for the word to count as (possibly misspelled) present
+SIMILARITY_THRESHOLD = 0.5
+
+WORD_SEPARATOR = re.compile(r"[\W_]+")
+
+
+def words(text: str) -> "list[str]":
+    return [word for word in WORD_SEPARATOR.split(text.lower()) if word]
+
+
+def word_trigrams(word: str, padding: str = " ") -> "set[str]":
+    padded = f"  {word}{padding}"
+    return {"".join(trigram) for trigram in zip(padded, padded[1:], padded[2:])}
+
+
+def put(column: "list[T]", position: int, value: "T") -> None:
+    """
+    Sets the value at the given position of a column, appending it if that's right after the last one.
+    """
+    if position == len(column):
+        column.append(value)
+    else:
+        column[position] = value
+
+
+def trigrams(text: str) -> "set[str]":
+    """
+    Splits text into lowercase words and returns their trigrams.
+
+    Like pg_trgm, each word is padded with two spaces in front and one at the end, so short words and word prefixes
+    produce trigrams too.
+    """
+    result = set()
+    for word in words(text):
+        result.update(word_trigrams(word))
+    return result
+
+
+class SearchScore(NamedTuple):
+    # Compared in this order, so exact matches outrank fuzzy ones and name matches outrank the rest
+    in_name: bool
+    in_document: bool
+    name_similarity: float
+    similarity: float
+
+
+class TrigramIndex:
+    """
+    Inverted trigram index over names, authors, descriptions and tags of a catalog snapshot.
+
+    Positions refer to the sequence of cached plugins the index was built from.
+    """
+
+    def __init__(self, plugins: "Sequence[CachedPlugin]"):
+        self.haystacks: "list[str]" = []
+        self.names: "list[str]" = []
+        self.name_trigrams: "list[frozenset[str]]" = []
+        self.document_trigrams: "list[frozenset[str]]" = []
+        postings: "dict[str, set[int]]" = {}
+        for position, plugin in enumerate(plugins):
+            self._set_document(position, plugin)
+            for trigram in self.document_trigrams[position]:
+                postings.setdefault(trigram, set()).add(position)
+        self.postings = {trigram: frozenset(positions) for trigram, positions in postings.items()}
+
+    def _set_document(self, position: int, plugin: "CachedPlugin") -> None:
+        """
+        Indexes a plugin's fields at the given position, appending it if that's right after the last one.
+        """
+        fields = [plugin.name, plugin.author, plugin.description, *(tag.tag for tag in plugin.tags)]
+        haystack = "\n".join(field for field in fields if field)
+        put(self.haystacks, position, haystack.lower())
+        put(self.names, position, plugin.name.lower())
+        put(self.name_trigrams, position, frozenset(trigrams(plugin.name)))
+        put(self.document_trigrams, position, frozenset(trigrams(haystack)))
+
+    def patched(self, changes: "dict[int, CachedPlugin | None]", size: int) -> "TrigramIndex":
+        """
+        Returns a copy of this index with the documents at the given positions replaced and only ``size`` positions
+        left, ``None`` marks positions being cut off.
+
+        Only the postings of trigrams of the changed documents are rebuilt, the rest is shared with this index.
+        """
+        index = TrigramIndex(())
+        index.haystacks = self.haystacks[:size]
+        index.names = self.names[:size]
+        index.name_trigrams = self.name_trigrams[:size]
+        index.document_trigrams = self.document_trigrams[:size]
+        postings: "dict[str, set[int]]" = {}
+        for position in changes:
+            if position < len(self.document_trigrams):
+                for trigram in self.document_trigrams[position]:
+                    postings.setdefault(trigram, set(self.postings[trigram])).discard(position)
+        for position, plugin in sorted(changes.items()):
+            if plugin is not None:
+                index._set_document(position, plugin)
+                for trigram in index.document_trigrams[position]:
+                    postings.setdefault(trigram, set(self.postings.get(trigram, ()))).add(position)
+        index.postings = dict(self.postings)
+        for trigram, positions in postings.items():
+            if positions:
+                index.postings[trigram] = frozenset(positions)
+            else:
+                del index.postings[trigram]
+        return index
+
+    def _candidates(self, query_trigrams: "Iterable[set[str]]") -> "set[int]":
+        candidates: "set[int]" = set()
+        for trigram in set().union(*query_trigrams):
+            candidates.update(self.postings.get(trigram, ()))
+        return candidates
+
+    @staticmethod
+    def _similarity(query_trigrams: "list[set[str]]", document_trigrams: "frozenset[str]") -> "tuple[float, float]":
+        """
+        Returns the lowest and the mean share of trigrams of each query word found in the document.
+        """
+        shares = [len(trigrams & document_trigrams) / len(trigrams) for trigrams in query_trigrams]
+        return min(shares), sum(shares) / len(shares)
+
+    def match(self, query: str) -> "dict[int, SearchScore]":
+        """
+        Returns scores of all positions matching the query, either as a substring or approximately.
+
+        Every query word has to be present in the document, but may be misspelled or, as the user is likely still
+        typing it, only a prefix of a word.
+        """
+        query = query.lower()
+        query_words = words(query)
+        if all(len(word) < 3 for word in query_words):
+            # Too short to tell typos apart from noise, so only substrings count.
+            return {
+                position: SearchScore(query in self.names[position], True, 1.0, 1.0)
+                for position, haystack in enumerate(self.haystacks)
+                if query in haystack
+            }
+
+        query_trigrams = [word_trigrams(word, padding="") for word in query_words]
+        scores = {}
+        for position in self._candidates(query_trigrams):
+            lowest, similarity = self._similarity(query_trigrams, self.document_trigrams[position])
+            in_document = query in self.haystacks[position]
+            if lowest < SIMILARITY_THRESHOLD and not in_document:
+                continue
+            _, name_similarity = self._similarity(query_trigrams, self.name_trigrams[position])
+            scores[position] = SearchScore(query in self.names[position], in_document, name_similarity, similarity)
+        return scores
@@ -0,0 +1,381 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from sys import intern
+from typing import NamedTuple, Optional, TYPE_CHECKING
+from zoneinfo import ZoneInfo
+
+import constants
+from constants import SortDirection, SortType
+
+from .search import TrigramIndex
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Hashable, Iterable, Iterator, Sequence
+
+    from .cache import CachedResponse
+    from .counters import Counts
+    from .models.Artifact import Artifact
+    from .models.Version import Version
+    from .search import SearchScore
+
+UTC = ZoneInfo("UTC")
+
+SORT_ATTRIBUTES: "dict[SortType | None, str]" = {
+    SortType.NAME: "name",
+    SortType.DATE: "created",
+    SortType.DOWNLOADS: "downloads",
+    None: "id",
+}
+
+
+class CachedTag(NamedTuple):
+    tag: str
+
+
+class CachedVersion(NamedTuple):
+    id: "int | None"
+    name: "str | None"
+    hash: "str | None"
+    created: "datetime | None"
+    downloads: "int | None"
+    updates: "int | None"
+
+    @classmethod
+    def from_orm(cls, version: "Version") -> "CachedVersion":
+        return cls(version.id, version.name, version.hash, version.created, version.downloads, version.updates)
+
+    def with_counts(self, counts: "Counts | None") -> "CachedVersion":
+        if counts is None:
+            return self
+        return self._replace(
+            downloads=(self.downloads or 0) + counts.downloads, updates=(self.updates or 0) + counts.updates
+        )
+
+
+class CachedPlugin(NamedTuple):
+    """
+    Read-only copy of an :class:`Artifact` with everything the catalog endpoints render.
+    """
+
+    id: int
+    name: str
+    author: str
+    description: str
+    tags: "tuple[CachedTag, ...]"
+    versions: "tuple[CachedVersion, ...]"
+    visible: bool
+    image_path: str
+    downloads: "int | None"
+    updates: "int | None"
+    created: "datetime | None"
+    updated: "datetime | None"
+
+    @classmethod
+    def from_orm(cls, artifact: "Artifact", tags: "dict[str, CachedTag]") -> "CachedPlugin":
+        return cls(
+            id=artifact.id,
+            name=artifact.name,
+            author=intern(artifact.author),
+            description=artifact.description,
+            tags=tuple(
+                tags.setdefault(tag.tag, CachedTag(intern(tag.tag))) for tag in artifact.tags if tag.tag is not None
+            ),
+            versions=tuple(CachedVersion.from_orm(version) for version in artifact.versions),
+            visible=artifact.visible,
+            image_path=artifact.image_path,
+            downloads=artifact.downloads,
+            updates=artifact.updates,
+            created=artifact.created,
+            updated=artifact.updated,
+        )
+
+    def with_counts(self, counts: "dict[int, Counts]") -> "CachedPlugin":
+        """
+        Returns this plugin with install counts added to the given version ids and its aggregates.
+        """
+        added = [counts[version.id] for version in self.versions if version.id in counts]
+        if not added:
+            return self
+        return self._replace(
+            versions=tuple(
+                version.with_counts(counts[version.id]) if version.id in counts else version
+                for version in self.versions
+            ),
+            downloads=(self.downloads or 0) + sum(count.downloads for count in added),
+            updates=(self.updates or 0) + sum(count.updates for count in added),
+        )
+
+    @property
+    def image_url(self):
+        return f"{constants.CDN_URL}{self.image_path}"
+
+
+class SearchPage(NamedTuple):
+    plugins: "list[CachedPlugin]"
+    # Sort key of the last plugin on this page if there are more matching plugins after it
+    next_key: "tuple | None"
+
+
+class CatalogSnapshot:
+    """
+    Immutable catalog contents of a single cache generation, together with indexes derived from them.
+
+    Built once per rebuild, or patched from the previous one for writes to single artifacts, and then only swapped by
+    reference, so readers never see a half-built catalog. The only mutable part are responses rendered from this
+    snapshot.
+    """
+
+    __slots__ = (
+        "plugins",
+        "generation",
+        "created",
+        "tags",
+        "names",
+        "version_ids",
+        "tag_index",
+        "orderings",
+        "text_index",
+        "responses",
+    )
+
+    def __init__(
+        self, plugins: "Iterable[CachedPlugin]" = (), generation: int = 0, text_index: "TrigramIndex | None" = None
+    ):
+        self.plugins = tuple(plugins)
+        self.generation = generation
+        self.created = datetime.now(UTC)
+        self.tags = {tag.tag: tag for plugin in self.plugins for tag in plugin.tags}
+        # Maps artifact names to their positions in ``plugins``
+        self.names = {plugin.name: position for position, plugin in enumerate(self.plugins)}
+        # Maps artifact and version names to version ids
+        self.version_ids = {
+            (plugin.name, version.name): version.id for plugin in self.plugins for version in plugin.versions
+        }
+        # Maps each tag to positions in ``plugins`` of artifacts carrying it
+        self.tag_index = self._build_tag_index(self.plugins)
+        # Positions in ``plugins`` presorted by every sort type in both directions
+        self.orderings = self._build_orderings()
+        # Positions only stay valid for the same plugins in the same order, which callers passing one ensure
+        self.text_index = TrigramIndex(self.plugins) if text_index is None else text_index
+        # Ordered by last use, see PluginCache.store_response
+        self.responses: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+
+    def with_plugin(self, artifact: "Artifact", counts: "dict[int, Counts] | None" = None) -> "CatalogSnapshot":
+        """
+        Returns the next snapshot with the given artifact added or replacing its previous version, optionally with
+        install counts added to it.
+        """
+        plugin = CachedPlugin.from_orm(artifact, dict(self.tags))
+        if counts:
+            plugin = plugin.with_counts(counts)
+        position = self._position(plugin.id)
+        plugins = list(self.plugins)
+        if position is None:
+            position = len(plugins)
+            plugins.append(plugin)
+        else:
+            plugins[position] = plugin
+        return self._patched(plugins, {position: plugin})
+
+    def without_plugin(self, artifact_id: int) -> "CatalogSnapshot":
+        """
+        Returns the next snapshot with the given artifact removed.
+
+        The last artifact takes over its position, so no other positions shift and the indexes only need patching.
+        """
+        position = self._position(artifact_id)
+        plugins = list(self.plugins)
+        if position is None:
+            return self._patched(plugins, {})
+        last = plugins.pop()
+        if position == len(plugins):
+            return self._patched(plugins, {position: None})
+        plugins[position] = last
+        return self._patched(plugins, {position: last, len(plugins): None})
+
+    def with_counts(self, counts: "dict[int, Counts]") -> "CatalogSnapshot":
+        """
+        Returns the next snapshot with install counts added to the given version ids and their artifacts' aggregates.
+
+        Only numbers change, so the text index is shared with this snapshot.
+        """
+        return CatalogSnapshot(
+            (plugin.with_counts(counts) for plugin in self.plugins), self.generation + 1, self.text_index
+        )
+
+    def _position(self, artifact_id: int) -> "int | None":
+        return next((position for position, plugin in enumerate(self.plugins) if plugin.id == artifact_id), None)
+
+    def _patched(
+        self, plugins: "Sequence[CachedPlugin]", changes: "dict[int, CachedPlugin | None]"
+    ) -> "CatalogSnapshot":
+        """
+        Returns the next snapshot of the given plugins, which differ from this snapshot's only at the positions of
+        ``changes``. ``None`` marks positions past the end of ``plugins``, which were cut off.
+
+        Indexes are copied and only patched at the changed positions instead of being built from scratch, so writes
+        to single artifacts stay cheap on large catalogs.
+        """
+        snapshot = CatalogSnapshot.__new__(CatalogSnapshot)
+        snapshot.plugins = tuple(plugins)
+        snapshot.generation = self.generation + 1
+        snapshot.created = datetime.now(UTC)
+        snapshot.responses = OrderedDict()
+        removed = {position: self.plugins[position] for position in changes if position < len(self.plugins)}
+        added = {position: plugin for position, plugin in changes.items() if plugin is not None}
+
+        snapshot.names = dict(self.names)
+        snapshot.version_ids = dict(self.version_ids)
+        for position, plugin in removed.items():
+            if snapshot.names.get(plugin.name) == position:
+                del snapshot.names[plugin.name]
+            for version in plugin.versions:
+                snapshot.version_ids.pop((plugin.name, version.name), None)
+        for position, plugin in added.items():
+            snapshot.names[plugin.name] = position
+            snapshot.version_ids.update(((plugin.name, version.name), version.id) for version in plugin.versions)
+
+        postings: "dict[str, set[int]]" = {}
+        for position, plugin in removed.items():
+            for tag in plugin.tags:
+                postings.setdefault(tag.tag, set(self.tag_index[tag.tag])).discard(position)
+        for position, plugin in added.items():
+            for tag in plugin.tags:
+                postings.setdefault(tag.tag, set(self.tag_index.get(tag.tag, ()))).add(position)
+        snapshot.tags = dict(self.tags)
+        snapshot.tag_index = dict(self.tag_index)
+        for plugin in added.values():
+            for tag in plugin.tags:
+                snapshot.tags.setdefault(tag.tag, tag)
+        for tag_name, positions in postings.items():
+            if positions:
+                snapshot.tag_index[tag_name] = frozenset(positions)
+            else:
+                del snapshot.tag_index[tag_name]
+                del snapshot.tags[tag_name]
+
+        # After taking out the changed positions by their old keys, all others have the same keys in both snapshots
+        snapshot.orderings = {}
+        for sort_by in SORT_ATTRIBUTES:
+            ascending = list(self.orderings[sort_by, SortDirection.ASC])
+            old_key = partial(self.sort_key, sort_by)
+            for position in removed:
+                del ascending[bisect_left(ascending, old_key(position), key=old_key)]
+            for position in added:
+                insort(ascending, position, key=partial(snapshot.sort_key, sort_by))
+            snapshot.orderings[sort_by, SortDirection.ASC] = tuple(ascending)
+            snapshot.orderings[sort_by, SortDirection.DESC] = tuple(reversed(ascending))
+
+        snapshot.text_index = self.text_index.patched(changes, len(plugins))
+        return snapshot
+
+    def get(self, name: str) -> "CachedPlugin | None":
+        position = self.names.get(name)
+        return None if position is None else self.plugins[position]
+
+    @staticmethod
+    def _build_tag_index(plugins: "Sequence[CachedPlugin]") -> "dict[str, frozenset[int]]":
+        index: "dict[str, set[int]]" = {}
+        for position, plugin in enumerate(plugins):
+            for tag in plugin.tags:
+                index.setdefault(tag.tag, set()).add(position)
+        return {tag: frozenset(positions) for tag, positions in index.items()}
+
+    def sort_key(self, sort_by: Optional[SortType], position: int) -> "tuple[bool, Any, int]":
+        """
+        Returns the key a position is presorted by for the given sort type.
+
+        Artifacts without versions have no aggregates, those go first. Ties are broken by id.
+        """
+        plugin = self.plugins[position]
+        value = getattr(plugin, SORT_ATTRIBUTES[sort_by])
+        return value is not None, value, plugin.id
+
+    def rank_key(
+        self, scores: "dict[int, SearchScore]", sort_direction: SortDirection, position: int
+    ) -> "tuple[bool, bool, float, float, int]":
+        """
+        Returns the key relevance ranked results are sorted by, in descending order.
+
+        Ties are broken by id in the requested direction.
+        """
+        plugin_id = self.plugins[position].id
+        return *scores[position], plugin_id if sort_direction == SortDirection.DESC else -plugin_id
+
+    def _build_orderings(self) -> "dict[tuple[SortType | None, SortDirection], tuple[int, ...]]":
+        orderings = {}
+        for sort_by in SORT_ATTRIBUTES:
+            ascending = tuple(sorted(range(len(self.plugins)), key=partial(self.sort_key, sort_by)))
+            orderings[sort_by, SortDirection.ASC] = ascending
+            orderings[sort_by, SortDirection.DESC] = ascending[::-1]
+        return orderings
+
+    def _walk(
+        self, sort_by: Optional[SortType], sort_direction: SortDirection, after: "tuple | None"
+    ) -> "Iterator[int]":
+        """
+        Iterates over presorted positions, starting right after the given sort key.
+        """
+        if after is None:
+            return iter(self.orderings[sort_by, sort_direction])
+        ascending = self.orderings[sort_by, SortDirection.ASC]
+        key = partial(self.sort_key, sort_by)
+        if sort_direction == SortDirection.ASC:
+            start = bisect_right(ascending, after, key=key)
+            return (ascending[i] for i in range(start, len(ascending)))
+        end = bisect_left(ascending, after, key=key)
+        return (ascending[i] for i in range(end - 1, -1, -1))
+
+    def _tagged(self, tags: "Iterable[str]") -> "frozenset[int]":
+        """
+        Returns positions of artifacts carrying all of the given tags.
+        """
+        postings = sorted((self.tag_index.get(tag, frozenset()) for tag in set(tags)), key=len)
+        return postings[0].intersection(*postings[1:])
+
+    def search(
+        self,
+        name: "str | None" = "",
+        tags: "Iterable[str] | None" = None,
+        include_hidden: "bool" = False,
+        sort_by: Optional[SortType] = None,
+        sort_direction: SortDirection = SortDirection.ASC,
+        after: "tuple | None" = None,
+        limit: "int | None" = None,
+    ) -> "SearchPage":
+        """
+        Returns artifacts matching all filters in the requested order.
+
+        A text query matches names, authors, descriptions and tags with some typo tolerance. Without an explicit
+        ``sort_by`` its results are ranked by relevance, ties keep the requested direction.
+
+        Results can be paged by passing ``next_key`` of the previous page as ``after``. Presorted orders are resumed
+        with a binary search, so each page only costs the plugins it walks over.
+        """
+        scores = self.text_index.match(name) if name else None
+        tagged = self._tagged(tags) if tags else None
+
+        def matches(position: int) -> bool:
+            if tagged is not None and position not in tagged:
+                return False
+            if scores is not None and position not in scores:
+                return False
+            return include_hidden or self.plugins[position].visible
+
+        key: "Callable[[int], tuple]"
+        if scores is not None and sort_by is None:
+            key = partial(self.rank_key, scores, sort_direction)
+            ranked = sorted(filter(matches, scores), key=key, reverse=True)
+            positions: "Iterator[int]" = iter(ranked if after is None else [p for p in ranked if key(p) < after])
+        else:
+            key = partial(self.sort_key, sort_by)
+            positions = filter(matches, self._walk(sort_by, sort_direction, after))
+
+        if limit is None:
+            return SearchPage([self.plugins[position] for position in positions], None)
+        page = list(islice(positions, limit + 1))
+        next_key = key(page[limit - 1]) if len(page) > limit else None
+        return SearchPage([self.plugins[position] for position in page[:limit]], next_key)
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from sys import getsizeof
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from redis.asyncio import Redis
+
+if TYPE_CHECKING:
+    from typing import Sequence
+
+    from limits import RateLimitItem
+
+# Counts a hit for each key unless its window already reached the limit, the first hit starts the window. Returns for
+# each key whether the hit was counted and, if it wasn't, the milliseconds until the window ends.
+HIT_SCRIPT = """
+local results = {}
+for i, key in ipairs(KEYS) do
+    local current = tonumber(redis.call("GET", key) or "0")
+    if current >= tonumber(ARGV[1]) then
+        results[i] = {0, redis.call("PTTL", key)}
+    else
+        if redis.call("INCR", key) == 1 then
+            redis.call("EXPIRE", key, ARGV[2])
+        end
+        results[i] = {1, 0}
+    end
+end
+return results
+"""
+
+# Prefix the ``limits`` Redis storages put in front of every key
+KEY_PREFIX = "LIMITS"
+
+# Estimated bytes of an entry besides its key, i.e. the expiry time and the ordered dict's bookkeeping
+ENTRY_OVERHEAD = 128
+
+
+class BlockedCache:
+    """
+    Size-bounded LRU cache of rate limit keys known to be over their limit, each until its window ends.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[str, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def entry_size(key: str) -> int:
+        return getsizeof(key) + ENTRY_OVERHEAD
+
+    def is_blocked(self, key: str) -> bool:
+        expires = self.entries.get(key)
+        if expires is not None:
+            if expires > monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True
+            self.remove(key)
+        self.misses += 1
+        return False
+
+    def block(self, key: str, ttl: float) -> None:
+        self.remove(key)
+        self.entries[key] = monotonic() + ttl
+        self.size += self.entry_size(key)
+        while self.size > self.max_bytes:
+            evicted, _ = self.entries.popitem(last=False)
+            self.size -= self.entry_size(evicted)
+
+    def remove(self, key: str) -> None:
+        if self.entries.pop(key, None) is not None:
+            self.size -= self.entry_size(key)
+
+
+class FixedWindowRateLimiter:
+    """
+    Fixed window rate limiter on a pooled asyncio Redis client.
+
+    Testing and counting hits is a single atomic script call, so concurrent requests can't overshoot the limit and
+    each request costs one round-trip. Keys and counters are laid out like the ones of the ``limits`` fixed window
+    strategy on its Redis storage, so windows started by either are shared.
+
+    Keys found over their limit are remembered in an in-process :class:`BlockedCache` until their window ends, so
+    clients retrying after being limited don't cause any Redis calls.
+    """
+
+    def __init__(self, redis: "Redis", blocked: "BlockedCache | None" = None):
+        self.redis = redis
+        self.hit_script = redis.register_script(HIT_SCRIPT)
+        self.blocked = blocked
+
+    @classmethod
+    def from_url(cls, url: str, blocked: "BlockedCache | None" = None) -> "FixedWindowRateLimiter":
+        return cls(Redis.from_url(url), blocked)
+
+    @staticmethod
+    def key_for(item: "RateLimitItem", *identifiers: str) -> str:
+        return f"{KEY_PREFIX}:{item.key_for(*identifiers)}"
+
+    async def hit(self, item: "RateLimitItem", *identifiers: str) -> bool:
+        """
+        Counts a hit for the given identifiers, returns ``False`` without counting it if the limit is reached.
+        """
+        [allowed] = await self.hit_many(item, [identifiers])
+        return allowed
+
+    async def hit_many(self, item: "RateLimitItem", identifiers: "Sequence[Sequence[str]]") -> "list[bool]":
+        """
+        Counts a hit for each of the given identifier sets in a single script call, like :meth:`hit` does for one.
+
+        Hits are counted in order, so repeated identifiers can use up the limit within the same call.
+        """
+        keys = [self.key_for(item, *ids) for ids in identifiers]
+        results = [False] * len(keys)
+        unknown = [i for i, key in enumerate(keys) if self.blocked is None or not self.blocked.is_blocked(key)]
+        if not unknown:
+            return results
+        replies = await self.hit_script(keys=[keys[i] for i in unknown], args=[item.amount, item.get_expiry()])
+        for i, (allowed, ttl) in zip(unknown, replies):
+            results[i] = bool(allowed)
+            if not allowed and ttl > 0 and self.blocked is not None:
+                self.blocked.block(keys[i], ttl / 1000)
+        return results
+
+    async def close(self) -> None:
+        await self.redis.aclose()
@@ -0,0 +1,147 @@
+from base64 import b64encode
+from hashlib import sha1
+from itertools import count
+
+from aiohttp import web
+
+
+class FakeB2:
+    """
+    Local stand-in for the parts of the B2 API the CDN uploader uses.
+
+    Tokens can be revoked to simulate them expiring, and parts of large files can be made to fail a number of times.
+    Every request is recorded.
+    """
+
+    def __init__(self, key_id: str = "key-id", key: str = "key"):
+        self.credentials = f"Basic {b64encode(f'{key_id}:{key}'.encode()).decode()}"
+        self.tokens = count(1)
+        self.account_tokens: "set[str]" = set()
+        self.upload_tokens: "dict[str, str]" = {}
+        self.files: "dict[str, bytes]" = {}
+        # Unfinished large files by ID, with their name and uploaded parts by number
+        self.large_files: "dict[str, tuple[str, dict[int, bytes]]]" = {}
+        self.cancelled: "list[str]" = []
+        # Times upload of a part number is still going to fail
+        self.part_failures: "dict[int, int]" = {}
+        self.requests: "list[str]" = []
+        self.app = web.Application()
+        self.app.router.add_get("/b2api/v2/b2_authorize_account", self.authorize_account)
+        self.app.router.add_post("/b2api/v2/b2_get_upload_url", self.get_upload_url)
+        self.app.router.add_post("/upload/{token}", self.upload_file)
+        self.app.router.add_post("/b2api/v2/b2_start_large_file", self.start_large_file)
+        self.app.router.add_post("/b2api/v2/b2_get_upload_part_url", self.get_upload_part_url)
+        self.app.router.add_post("/upload_part/{token}", self.upload_part)
+        self.app.router.add_post("/b2api/v2/b2_finish_large_file", self.finish_large_file)
+        self.app.router.add_post("/b2api/v2/b2_cancel_large_file", self.cancel_large_file)
+
+    @staticmethod
+    def error(status: int, code: str) -> "web.Response":
+        return web.json_response({"status": status, "code": code, "message": code}, status=status)
+
+    def revoke_tokens(self) -> None:
+        self.account_tokens.clear()
+        self.upload_tokens.clear()
+
+    async def authorize_account(self, request: "web.Request") -> "web.Response":
+        self.requests.append("b2_authorize_account")
+        if request.headers.get("Authorization") != self.credentials:
+            return self.error(401, "unauthorized")
+        token = f"account-{next(self.tokens)}"
+        self.account_tokens.add(token)
+        return web.json_response({"apiUrl": str(request.url.origin()), "authorizationToken": token})
+
+    async def get_upload_url(self, request: "web.Request") -> "web.Response":
+        self.requests.append("b2_get_upload_url")
+        if request.headers.get("Authorization") not in self.account_tokens:
+            return self.error(401, "expired_auth_token")
+        token = f"upload-{next(self.tokens)}"
+        self.upload_tokens[token] = (await request.json())["bucketId"]
+        return web.json_response(
+            {"uploadUrl": str(request.url.origin().with_path(f"/upload/{token}")), "authorizationToken": token}
+        )
+
+    @staticmethod
+    async def read_body(request: "web.Request") -> "bytes | None":
+        body = await request.read()
+        # B2 needs the length up front, it doesn't accept chunked bodies
+        if "Transfer-Encoding" in request.headers or request.content_length != len(body):
+            return None
+        if request.headers["X-Bz-Content-Sha1"] != sha1(body).hexdigest():
+            return None
+        return body
+
+    async def upload_file(self, request: "web.Request") -> "web.Response":
+        self.requests.append("upload")
+        token = request.match_info["token"]
+        if request.headers.get("Authorization") != token or token not in self.upload_tokens:
+            return self.error(401, "expired_auth_token")
+        if (body := await self.read_body(request)) is None:
+            return self.error(400, "bad_request")
+        name = request.headers["X-Bz-File-Name"]
+        self.files[name] = body
+        return web.json_response({"fileName": name, "contentLength": len(body)})
+
+    async def start_large_file(self, request: "web.Request") -> "web.Response":
+        self.requests.append("b2_start_large_file")
+        if request.headers.get("Authorization") not in self.account_tokens:
+            return self.error(401, "expired_auth_token")
+        file_id = f"file-{next(self.tokens)}"
+        self.large_files[file_id] = ((await request.json())["fileName"], {})
+        return web.json_response({"fileId": file_id})
+
+    async def get_upload_part_url(self, request: "web.Request") -> "web.Response":
+        self.requests.append("b2_get_upload_part_url")
+        if request.headers.get("Authorization") not in self.account_tokens:
+            return self.error(401, "expired_auth_token")
+        file_id = (await request.json())["fileId"]
+        if file_id not in self.large_files:
+            return self.error(400, "bad_request")
+        token = f"part-{next(self.tokens)}"
+        self.upload_tokens[token] = file_id
+        return web.json_response(
+            {"uploadUrl": str(request.url.origin().with_path(f"/upload_part/{token}")), "authorizationToken": token}
+        )
+
+    async def upload_part(self, request: "web.Request") -> "web.Response":
+        self.requests.append("upload_part")
+        token = request.match_info["token"]
+        if request.headers.get("Authorization") != token or token not in self.upload_tokens:
+            return self.error(401, "expired_auth_token")
+        number = int(request.headers["X-Bz-Part-Number"])
+        if self.part_failures.get(number):
+            self.part_failures[number] -= 1
+            # B2 wants a new part upload URL after a failure
+            del self.upload_tokens[token]
+            return self.error(503, "service_unavailable")
+        if (body := await self.read_body(request)) is None:
+            return self.error(400, "bad_request")
+        file_id = self.upload_tokens[token]
+        if file_id not in self.large_files:
+            return self.error(400, "bad_request")
+        self.large_files[file_id][1][number] = body
+        return web.json_response({"fileId": file_id, "partNumber": number, "contentLength": len(body)})
+
+    async def finish_large_file(self, request: "web.Request") -> "web.Response":
+        self.requests.append("b2_finish_large_file")
+        if request.headers.get("Authorization") not in self.account_tokens:
+            return self.error(401, "expired_auth_token")
+        payload = await request.json()
+        name, parts = self.large_files[payload["fileId"]]
+        bodies = [parts[number] for number in sorted(parts)]
+        if sorted(parts) != list(range(1, len(parts) + 1)) or payload["partSha1Array"] != [
+            sha1(body).hexdigest() for body in bodies
+        ]:
+            return self.error(400, "bad_request")
+        del self.large_files[payload["fileId"]]
+        self.files[name] = b"".join(bodies)
+        return web.json_response({"fileId": payload["fileId"], "fileName": name})
+
+    async def cancel_large_file(self, request: "web.Request") -> "web.Response":
+        self.requests.append("b2_cancel_large_file")
+        if request.headers.get("Authorization") not in self.account_tokens:
+            return self.error(401, "expired_auth_token")
+        file_id = (await request.json())["fileId"]
+        self.large_files.pop(file_id)
+        self.cancelled.append(file_id)
+        return web.json_response({"fileId": file_id})
@@ -11,6 +11,10 @@ from sqlalchemy.orm import sessionmaker
 
 import main
 from api import database as db_dependency
+from api import database_fake as cache_db_dependency
+from api import prerender_catalog
+from database.cache import PluginCache
+from database.counters import CounterBuffer
 from database.database import Database
 from db_helpers import (
     create_test_db_engine,
@@ -92,11 +96,33 @@ async def seed_db_session(seed_db_engine: tuple["AsyncEngine", "sessionmaker"])
 
 @pytest_asyncio.fixture()
 async def seed_db(plugin_store: "FastAPI", seed_db_session: "AsyncSession", mocker: "MockFixture") -> "Database":
-    database = Database(seed_db_session, lock=mocker.MagicMock())
+    plugin_cache = PluginCache()
+    plugin_cache.subscribe(prerender_catalog)
+    database = Database(seed_db_session, lock=mocker.MagicMock(), plugin_cache=plugin_cache, counters=CounterBuffer())
+    await database.update_cache(seed_db_session)
+    # Cached artifacts must not share identity with the ones tests load through the session
+    seed_db_session.expunge_all()
     main.app.dependency_overrides[db_dependency] = lambda: database
+    main.app.dependency_overrides[cache_db_dependency] = lambda: database
     return database
 
 
+@pytest_asyncio.fixture()
+async def seed_db_foreign_keys(mocker: "MockFixture") -> "AsyncIterator[Database]":
+    """
+    Like ``seed_db``, but on a database of its own which enforces foreign keys.
+    """
+    engine = create_test_db_engine(foreign_keys=True)
+    db_sessionmaker = create_test_db_sessionmaker(engine)
+    await prepare_test_db(engine, db_sessionmaker, True)
+    session = db_sessionmaker()
+    database = Database(session, lock=mocker.MagicMock(), plugin_cache=PluginCache(), counters=CounterBuffer())
+    await database.update_cache(session)
+    yield database
+    await session.close()
+    await engine.dispose()
+
+
 @pytest.fixture()
 def plugin_submit_data(request: "pytest.FixtureRequest") -> "tuple[dict, dict]":
     data = {
@@ -118,15 +118,24 @@ class FakePluginGenerator:
         self.created_plugins_count += 1
 
 
-def create_test_db_engine() -> "AsyncEngine":
+def create_test_db_engine(foreign_keys: bool = False) -> "AsyncEngine":
     db_url = getenv("DB_URL")
     if not db_url:
         raise Exception("DB_URL not provided or invalid!")
-    return create_async_engine(
+    engine = create_async_engine(
         db_url,
         pool_pre_ping=True,
         # echo=True,
     )
+    if foreign_keys and engine.dialect.name == "sqlite":
+        # SQLite only enforces foreign keys when asked to, on each connection before any transaction
+        @event.listens_for(engine.sync_engine, "connect")
+        def enable_foreign_keys(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+    return engine
 
 
 def create_test_db_sessionmaker(engine: "AsyncEngine") -> "async_sessionmaker":
@@ -140,6 +140,25 @@ async def test_announcement_list_current(
     }
 
 
+async def test_announcement_list_current_conditional_get(
+    client_auth: "AsyncClient",
+    seed_db: "Database",
+):
+    response = await client_auth.get("/v1/announcements/-/current")
+    etag = response.headers["ETag"]
+
+    response = await client_auth.get("/v1/announcements/-/current", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
+    await client_auth.delete("/v1/announcements/01234568-79ab-7cde-a445-b9f117ca645d")
+
+    response = await client_auth.get("/v1/announcements/-/current", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 1
+
+
 async def test_announcement_fetch(
     client_auth: "AsyncClient",
     seed_db: "Database",
@@ -0,0 +1,199 @@
+from asyncio import gather
+from hashlib import sha1, sha256
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import TestServer
+from fastapi import UploadFile
+
+from b2_helpers import FakeB2
+from cdn import b2_upload, B2Uploader, B2UploadError, upload_version, UploadBody
+from constants import CDN_ERROR_RETRY_TIMES
+
+if TYPE_CHECKING:
+    from typing import AsyncIterator
+
+    from pytest_mock import MockFixture
+
+
+@pytest.fixture()
+def small_parts(mocker: "MockFixture") -> None:
+    mocker.patch("cdn.CDN_CHUNK_SIZE", 1000)
+    mocker.patch("cdn.CDN_PART_SIZE", 4096)
+    mocker.patch("cdn.CDN_LARGE_FILE_SIZE", 8192)
+
+
+@pytest.fixture()
+def fake_b2() -> "FakeB2":
+    return FakeB2()
+
+
+@pytest_asyncio.fixture()
+async def uploader(fake_b2: "FakeB2") -> "AsyncIterator[B2Uploader]":
+    async with TestServer(fake_b2.app) as server:
+        uploader = B2Uploader("key-id", "key", "bucket", api_url=f"http://{server.host}:{server.port}")
+        yield uploader
+        await uploader.close()
+
+
+@pytest.mark.asyncio
+async def test_uploader_reuses_authorization_and_upload_urls(fake_b2: "FakeB2", uploader: "B2Uploader"):
+    await uploader.upload("first.zip", b"first")
+    await uploader.upload("second.zip", b"second")
+
+    assert fake_b2.files == {"first.zip": b"first", "second.zip": b"second"}
+    assert fake_b2.requests == ["b2_authorize_account", "b2_get_upload_url", "upload", "upload"]
+
+
+@pytest.mark.asyncio
+async def test_uploader_pools_upload_urls_for_concurrent_uploads(fake_b2: "FakeB2", uploader: "B2Uploader"):
+    await gather(*(uploader.upload(f"{i}.zip", b"data") for i in range(3)))
+    assert len(uploader.upload_urls) == 3
+
+    fake_b2.requests.clear()
+    await gather(*(uploader.upload(f"{i}.zip", b"data") for i in range(3, 6)))
+    assert fake_b2.requests == ["upload"] * 3
+
+
+@pytest.mark.asyncio
+async def test_uploader_authorizes_again_when_rejected(fake_b2: "FakeB2", uploader: "B2Uploader"):
+    await uploader.upload("first.zip", b"first")
+    fake_b2.revoke_tokens()
+    fake_b2.requests.clear()
+
+    await uploader.upload("second.zip", b"second")
+
+    assert fake_b2.files["second.zip"] == b"second"
+    assert fake_b2.requests == [
+        "upload",
+        "b2_get_upload_url",
+        "b2_authorize_account",
+        "b2_get_upload_url",
+        "upload",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_uploader_retries_with_new_upload_url(fake_b2: "FakeB2", uploader: "B2Uploader"):
+    await gather(*(uploader.upload(f"{i}.zip", b"data") for i in range(2)))
+    assert len(uploader.upload_urls) == 2
+    fake_b2.revoke_tokens()
+    fake_b2.requests.clear()
+
+    await uploader.upload("2.zip", b"data")
+
+    assert fake_b2.files["2.zip"] == b"data"
+    assert fake_b2.requests == [
+        "upload",
+        "b2_get_upload_url",
+        "b2_authorize_account",
+        "b2_get_upload_url",
+        "upload",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_uploader_streams_files(fake_b2: "FakeB2", uploader: "B2Uploader", mocker: "MockFixture"):
+    mocker.patch("cdn.CDN_CHUNK_SIZE", 1000)
+    data = bytes(range(256)) * 50
+    read = mocker.spy(UploadFile, "read")
+
+    file_hash, body = await UploadBody.from_file(UploadFile(BytesIO(data)))
+    assert file_hash == sha256(data).hexdigest()
+    assert body.size == len(data)
+    await uploader.upload("streamed.zip", body)
+
+    assert fake_b2.files["streamed.zip"] == data
+    assert max(call.args[1] for call in read.call_args_list) == 1000
+
+
+@pytest.mark.asyncio
+async def test_upload_version_streams_file(mocker: "MockFixture"):
+    b2_upload = mocker.patch("cdn.b2_upload")
+    data = b"plugin zip" * 1000
+
+    result = await upload_version(UploadFile(BytesIO(data)))
+
+    file_hash = sha256(data).hexdigest()
+    assert result == {"hash": file_hash}
+    filename, body = b2_upload.call_args.args
+    assert filename == f"versions/{file_hash}.zip"
+    assert b"".join([chunk async for chunk in body.chunks()]) == data
+
+
+@pytest.mark.asyncio
+async def test_b2_upload_raises_once_retries_are_exhausted(mocker: "MockFixture"):
+    upload = mocker.patch("cdn.uploader.upload", side_effect=B2UploadError("rejected"))
+    sleep = mocker.patch("cdn.sleep")
+
+    with pytest.raises(B2UploadError):
+        await b2_upload("versions/failed.zip", b"failed")
+
+    assert upload.await_count == CDN_ERROR_RETRY_TIMES
+    assert sleep.await_count == CDN_ERROR_RETRY_TIMES - 1
+
+
+@pytest.mark.asyncio
+async def test_uploader_skips_stored_files(fake_b2: "FakeB2", uploader: "B2Uploader"):
+    uploader.stored.add("versions/known.zip")
+
+    assert await uploader.upload("versions/known.zip", b"known") is None
+    assert await uploader.upload("versions/new.zip", b"new") is not None
+    assert await uploader.upload("versions/new.zip", b"new") is None
+
+    assert list(fake_b2.files) == ["versions/new.zip"]
+    assert fake_b2.requests.count("upload") == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("small_parts")
+async def test_uploader_uploads_large_files_in_parts(fake_b2: "FakeB2", uploader: "B2Uploader", mocker: "MockFixture"):
+    mocker.patch("cdn.CDN_PART_CONCURRENCY", 2)
+    data = bytes(range(256)) * 70
+
+    _, body = await UploadBody.from_file(UploadFile(BytesIO(data)))
+    assert body.part_sha1s == UploadBody.from_bytes(data).part_sha1s
+    assert body.part_sha1s[-1] == sha1(data[16384:]).hexdigest()
+    await uploader.upload("versions/large.zip", body)
+
+    assert fake_b2.files["versions/large.zip"] == data
+    assert fake_b2.requests.count("upload_part") == 5
+    assert fake_b2.requests.count("b2_get_upload_part_url") == 2
+    assert "upload" not in fake_b2.requests
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("small_parts")
+async def test_uploader_uploads_small_files_at_once(fake_b2: "FakeB2", uploader: "B2Uploader"):
+    await uploader.upload("versions/small.zip", b"small" * 1000)
+
+    assert fake_b2.files["versions/small.zip"] == b"small" * 1000
+    assert "b2_start_large_file" not in fake_b2.requests
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("small_parts")
+async def test_uploader_retries_failed_parts(fake_b2: "FakeB2", uploader: "B2Uploader"):
+    data = bytes(range(256)) * 70
+    fake_b2.part_failures = {2: 1, 4: 2}
+
+    await uploader.upload("versions/large.zip", data)
+
+    assert fake_b2.files["versions/large.zip"] == data
+    assert fake_b2.requests.count("upload_part") == 5 + 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("small_parts")
+async def test_uploader_cancels_large_file_when_part_fails(fake_b2: "FakeB2", uploader: "B2Uploader"):
+    fake_b2.part_failures = {3: 3}
+
+    with pytest.raises(B2UploadError):
+        await uploader.upload("versions/large.zip", bytes(range(256)) * 70)
+
+    assert fake_b2.files == {}
+    assert fake_b2.large_files == {}
+    assert len(fake_b2.cancelled) == 1
+    assert "versions/large.zip" not in uploader.stored
@@ -0,0 +1,63 @@
+from typing import TYPE_CHECKING
+
+import pytest
+from limits import parse
+
+from limiter import BlockedCache, FixedWindowRateLimiter
+
+if TYPE_CHECKING:
+    from freezegun.api import FrozenDateTimeFactory
+    from pytest_mock import MockFixture
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_caches_blocked_keys(mocker: "MockFixture", freezer: "FrozenDateTimeFactory"):
+    blocked = BlockedCache(max_bytes=1024)
+    rate_limit = FixedWindowRateLimiter(mocker.MagicMock(), blocked)
+    hit_script = mocker.patch.object(
+        rate_limit, "hit_script", new_callable=mocker.AsyncMock, side_effect=[[[1, 0]], [[0, 60_000]], [[1, 0]]]
+    )
+    limit = parse("1/minute")
+
+    assert await rate_limit.hit(limit, "plugin-1", "client")
+    assert not await rate_limit.hit(limit, "plugin-1", "client")
+    assert not await rate_limit.hit(limit, "plugin-1", "client")
+    assert hit_script.await_count == 2
+    assert (blocked.hits, blocked.misses) == (1, 2)
+
+    freezer.tick(61)
+    assert await rate_limit.hit(limit, "plugin-1", "client")
+    assert hit_script.await_count == 3
+    assert blocked.entries == {}
+
+
+def test_blocked_cache_evicts_least_recently_used():
+    keys = [f"LIMITS:LIMITER/plugin-{i}/client/1/1/minute" for i in range(3)]
+    blocked = BlockedCache(max_bytes=2 * BlockedCache.entry_size(keys[0]))
+
+    blocked.block(keys[0], 60)
+    blocked.block(keys[1], 60)
+    assert blocked.is_blocked(keys[0])
+    blocked.block(keys[2], 60)
+
+    assert list(blocked.entries) == [keys[0], keys[2]]
+    assert blocked.size <= blocked.max_bytes
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_hits_many_in_one_call(mocker: "MockFixture"):
+    blocked = BlockedCache(max_bytes=1024)
+    rate_limit = FixedWindowRateLimiter(mocker.MagicMock(), blocked)
+    hit_script = mocker.patch.object(
+        rate_limit, "hit_script", new_callable=mocker.AsyncMock, return_value=[[1, 0], [0, 60_000]]
+    )
+    limit = parse("1/minute")
+    blocked.block(rate_limit.key_for(limit, "plugin-3", "client"), 60)
+
+    results = await rate_limit.hit_many(limit, [("plugin-1", "client"), ("plugin-2", "client"), ("plugin-3", "client")])
+
+    assert results == [True, False, False]
+    hit_script.assert_awaited_once_with(
+        keys=["LIMITS:LIMITER/plugin-1/client/1/1/minute", "LIMITS:LIMITER/plugin-2/client/1/1/minute"], args=[1, 60]
+    )
+    assert blocked.is_blocked(rate_limit.key_for(limit, "plugin-2", "client"))
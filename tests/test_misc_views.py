@@ -3,8 +3,11 @@ from typing import TYPE_CHECKING
 import pytest
 from pytest_lazyfixture import lazy_fixture
 
+from limiter import BlockedCache
+
 if TYPE_CHECKING:
     from httpx import AsyncClient
+    from pytest_mock import MockFixture
 
 
 @pytest.mark.asyncio
@@ -23,3 +26,22 @@ async def test_index_endpoint(client: "AsyncClient", index_template: str):
 async def test_auth_endpoint(client: "AsyncClient", return_code: int):
     response = await client.post("/__auth")
     assert response.status_code == return_code
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_endpoint_requires_auth(client_unauth: "AsyncClient"):
+    response = await client_unauth.get("/__rate_limit")
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_endpoint(client_auth: "AsyncClient", mocker: "MockFixture"):
+    blocked = mocker.patch("api.rate_limit.blocked", BlockedCache(max_bytes=1024))
+    blocked.block("LIMITS:LIMITER/plugin-1/client/2/1/day", 60)
+    blocked.is_blocked("LIMITS:LIMITER/plugin-1/client/2/1/day")
+    blocked.is_blocked("LIMITS:LIMITER/plugin-2/client/2/1/day")
+
+    response = await client_auth.get("/__rate_limit")
+
+    assert response.status_code == 200
+    assert response.json() == {"entries": 1, "size": blocked.size, "max_bytes": 1024, "hits": 1, "misses": 1}
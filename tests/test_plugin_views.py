@@ -1,3 +1,5 @@
+import asyncio
+from datetime import date, datetime, UTC
 from typing import TYPE_CHECKING
 from urllib.parse import urlencode
 
@@ -8,11 +10,21 @@ from pytest_mock import MockFixture
 from sqlalchemy import func, select
 from sqlalchemy.exc import NoResultFound
 
+import api
+from api import remember_stored_files
+from api.utils import fingerprint
+from cdn import B2Uploader, construct_version_path
 from constants import SortDirection, SortType
+from database.cache import CachedResponse, PluginCache
+from database.counters import Counts
+from database.database import flush_counters_periodically
+from database.models import VersionCounterShard
 from database.models.Artifact import Tag
+from database.search import TrigramIndex
+from database.snapshot import CatalogSnapshot
 
 if TYPE_CHECKING:
-    from typing import Union
+    from typing import NoReturn, Union
 
     from freezegun.api import FrozenDateTimeFactory
     from httpx import AsyncClient
@@ -40,7 +52,7 @@ async def test_increment_endpoint(
     isUpdate: "bool | None",
     mocker: "MockFixture",
 ):
-    mocker.patch("api.rate_limit")  # remove ratelimit
+    mocker.patch("api.rate_limit.hit", return_value=True)  # remove ratelimit
     if isUpdate is None:
         response = await client.post(f"/plugins/{plugin_name}/versions/{version_name}/increment")
     else:
@@ -48,6 +60,7 @@ async def test_increment_endpoint(
 
     assert response.status_code == return_code
     if response.status_code == 200:
+        await seed_db.flush_counters(seed_db.session)
         plugin = await seed_db.get_plugin_by_id(seed_db.session, 1)
         if isUpdate is False:
             assert plugin.versions[0].downloads == 1
@@ -61,6 +74,334 @@ async def test_increment_endpoint(
             assert plugin.updates == 1
 
 
+@pytest.mark.asyncio
+async def test_increment_endpoint_rate_limit(seed_db: "Database", client_unauth: "AsyncClient", mocker: "MockFixture"):
+    hit = mocker.patch("api.rate_limit.hit", return_value=False)
+
+    response = await client_unauth.post("/plugins/plugin-1/versions/not_a_real_version/increment")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    hit.assert_not_called()
+
+    response = await client_unauth.post("/plugins/plugin-1/versions/1.0.0/increment")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    hit.assert_awaited_once()
+    assert seed_db.counters.pending == {}
+
+
+@pytest.mark.asyncio
+async def test_increment_endpoint_rate_limit_key(
+    seed_db: "Database", client_unauth: "AsyncClient", mocker: "MockFixture"
+):
+    hit = mocker.patch("api.rate_limit.hit", return_value=True)
+
+    await client_unauth.post("/plugins/plugin-1/versions/1.0.0/increment")
+    await client_unauth.post("/plugins/plugin-1/versions/1.0.0/increment", headers={"cf-connecting-ip": "203.0.113.7"})
+
+    assert [call.args[1:] for call in hit.await_args_list] == [
+        ("plugin-1", fingerprint("127.0.0.1", "cafebabe")),
+        ("plugin-1", fingerprint("203.0.113.7", "cafebabe")),
+    ]
+    # Doesn't depend on the per-process hash seed
+    assert fingerprint("203.0.113.7", "secret") == "c6efd33189fb08f0982df2bd75393b42"
+    assert fingerprint("203.0.113.7", "other") != fingerprint("203.0.113.7", "secret")
+
+
+@pytest.mark.asyncio
+async def test_increment_endpoint_buffers_counts(
+    seed_db: "Database",
+    client_unauth: "AsyncClient",
+    mocker: "MockFixture",
+):
+    mocker.patch("api.rate_limit.hit", return_value=True)  # remove ratelimit
+    execute = mocker.spy(seed_db.session, "execute")
+    for query in ["", "?isUpdate=true", "?isUpdate=false", "?isUpdate=false"]:
+        response = await client_unauth.post(f"/plugins/plugin-1/versions/1.0.0/increment{query}")
+        assert response.status_code == 200
+    # Versions are resolved through the plugin cache
+    assert execute.call_count == 0
+
+    plugin = await seed_db.get_plugin_by_id(seed_db.session, 1)
+    assert plugin.versions[0].downloads == 0
+    assert plugin.versions[0].updates == 0
+
+    execute.reset_mock()
+    await seed_db.flush_counters(seed_db.session)
+    # A lookup of still existing versions, then one batched update each of versions, their artifacts' aggregates and
+    # daily stats
+    assert execute.call_count == 4
+    await seed_db.flush_counters(seed_db.session)
+    assert execute.call_count == 4
+    seed_db.session.expunge_all()
+
+    plugin = await seed_db.get_plugin_by_id(seed_db.session, 1)
+    assert plugin.versions[0].downloads == 2
+    assert plugin.versions[0].updates == 2
+    assert plugin.downloads == 2
+    assert plugin.updates == 2
+
+
+@pytest.mark.asyncio
+async def test_flush_in_progress_survives_cancellation(mocker: "MockFixture"):
+    mocker.patch("database.database.COUNTER_FLUSH_INTERVAL", 0)
+    started, release, finished = asyncio.Event(), asyncio.Event(), asyncio.Event()
+
+    async def flush():
+        started.set()
+        await release.wait()
+        finished.set()
+
+    mocker.patch("database.database.flush_counters", side_effect=flush)
+    task = asyncio.create_task(flush_counters_periodically())
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    release.set()
+    await asyncio.wait_for(finished.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_flush_drops_counts_of_deleted_versions(seed_db_foreign_keys: "Database"):
+    db = seed_db_foreign_keys
+    await db.increment_installs(db.session, "plugin-1", "1.0.0", False)
+    await db.increment_installs(db.session, "plugin-2", "2.0.0", False)
+    await db.delete_plugin(db.session, 1)
+
+    await db.flush_counters(db.session)
+
+    assert db.counters.pending == {}
+    plugin = await db.get_plugin_by_id(db.session, 2)
+    assert plugin.downloads == 1
+    stats = await db.get_stats(db.session, 2, date(2000, 1, 1), date(2100, 1, 1))
+    assert [(name, downloads) for name, _, downloads, _ in stats] == [("2.0.0", 1)]
+
+
+@pytest.mark.asyncio
+async def test_sharded_flush_drops_counts_of_deleted_versions(seed_db_foreign_keys: "Database", mocker: "MockFixture"):
+    mocker.patch("database.database.COUNTER_SHARDS", 4)
+    db = seed_db_foreign_keys
+    await db.increment_installs(db.session, "plugin-1", "1.0.0", False)
+    await db.increment_installs(db.session, "plugin-2", "2.0.0", False)
+    await db.delete_plugin(db.session, 1)
+
+    await db.flush_counters(db.session)
+    await db.compact_counters(db.session)
+
+    assert db.counters.pending == {}
+    assert (await db.session.execute(select(func.count()).select_from(VersionCounterShard))).scalar() == 0
+    db.session.expunge_all()
+    assert (await db.get_plugin_by_id(db.session, 2)).downloads == 1
+
+
+@pytest.mark.asyncio
+async def test_flush_retries_after_integrity_errors(seed_db_foreign_keys: "Database", mocker: "MockFixture"):
+    db = seed_db_foreign_keys
+    version_ids = [db.plugin_cache.version_id("plugin-1", "1.0.0"), db.plugin_cache.version_id("plugin-2", "2.0.0")]
+    await db.increment_installs(db.session, "plugin-1", "1.0.0", False)
+    await db.increment_installs(db.session, "plugin-2", "2.0.0", False)
+    await db.delete_plugin(db.session, 1)
+    # As if plugin-1 was deleted right after its version was found to still exist the first time
+    lookups = [version_ids]
+    scalars = db.session.scalars
+
+    async def lookup(statement):
+        return lookups.pop() if lookups else await scalars(statement)
+
+    mocker.patch.object(db.session, "scalars", side_effect=lookup)
+
+    await db.flush_counters(db.session)
+
+    assert db.counters.pending == {}
+    assert db.plugin_cache.unfolded_counts == {version_ids[1]: Counts(1, 0)}
+    db.session.expunge_all()
+    assert (await db.get_plugin_by_id(db.session, 2)).downloads == 1
+
+
+@pytest.mark.asyncio
+async def test_increment_endpoint_updates_cached_counts(
+    seed_db: "Database",
+    client_unauth: "AsyncClient",
+    mocker: "MockFixture",
+):
+    mocker.patch("api.rate_limit.hit", return_value=True)  # remove ratelimit
+    full_reload = mocker.spy(seed_db, "_iter_artifacts")
+    for plugin_name, version_name in [("plugin-2", "2.0.0"), ("plugin-2", "1.1.0"), ("plugin-4", "1.0.0")]:
+        response = await client_unauth.post(f"/plugins/{plugin_name}/versions/{version_name}/increment?isUpdate=false")
+        assert response.status_code == 200
+    generation = seed_db.plugin_cache.generation
+    await seed_db.flush_counters(seed_db.session)
+    # Cached responses stay valid until the counts are folded in
+    assert seed_db.plugin_cache.generation == generation
+    seed_db.plugin_cache.fold_counts()
+    full_reload.assert_not_called()
+    assert seed_db.plugin_cache.generation == generation + 1
+
+    response = await client_unauth.get("/plugins", params={"sort_by": "downloads", "sort_direction": "desc"})
+    plugins = response.json()
+    assert [plugin["name"] for plugin in plugins[:2]] == ["plugin-2", "plugin-4"]
+    assert plugins[0]["downloads"] == 2
+    assert [version["downloads"] for version in plugins[0]["versions"]] == [1, 1]
+    assert plugins[1]["downloads"] == 1
+
+
+@pytest.mark.asyncio
+async def test_plugin_cache_drops_unfolded_counts_of_reloaded_plugins(
+    seed_db: "Database",
+    client_unauth: "AsyncClient",
+    mocker: "MockFixture",
+):
+    mocker.patch("api.rate_limit.hit", return_value=True)  # remove ratelimit
+    await client_unauth.post("/plugins/plugin-1/versions/1.0.0/increment?isUpdate=false")
+    await client_unauth.post("/plugins/plugin-2/versions/2.0.0/increment?isUpdate=false")
+    await seed_db.flush_counters(seed_db.session)
+
+    await seed_db.refresh_cached_plugin(seed_db.session, 1)
+    plugin = seed_db.plugin_cache.get("plugin-1")
+    assert plugin is not None
+    assert plugin.downloads == 1
+    seed_db.plugin_cache.fold_counts()
+
+    for name in ("plugin-1", "plugin-2"):
+        plugin = seed_db.plugin_cache.get(name)
+        assert plugin is not None
+        assert plugin.downloads == 1
+    assert seed_db.plugin_cache.unfolded_counts == {}
+
+
+@pytest.mark.asyncio
+async def test_increment_endpoint_sharded_counts(
+    seed_db: "Database",
+    client_unauth: "AsyncClient",
+    mocker: "MockFixture",
+):
+    mocker.patch("api.rate_limit.hit", return_value=True)  # remove ratelimit
+    mocker.patch("database.database.COUNTER_SHARDS", 4)
+    for _ in range(3):
+        await client_unauth.post("/plugins/plugin-1/versions/1.0.0/increment?isUpdate=false")
+        await seed_db.flush_counters(seed_db.session)
+
+    shards = (await seed_db.session.execute(select(func.count()).select_from(VersionCounterShard))).scalar()
+    assert 1 <= shards <= 3
+    plugin = await seed_db.get_plugin_by_id(seed_db.session, 1)
+    assert plugin.downloads == 0
+    seed_db.session.expunge_all()
+
+    for _ in range(2):
+        await seed_db.update_cache(seed_db.session)
+        cached = seed_db.plugin_cache.get("plugin-1")
+        assert cached is not None
+        assert cached.downloads == 3
+        await seed_db.refresh_cached_plugin(seed_db.session, 1)
+        cached = seed_db.plugin_cache.get("plugin-1")
+        assert cached is not None
+        assert cached.downloads == 3
+        await seed_db.compact_counters(seed_db.session)
+
+    assert (await seed_db.session.execute(select(func.count()).select_from(VersionCounterShard))).scalar() == 0
+    plugin = await seed_db.get_plugin_by_id(seed_db.session, 1)
+    assert plugin.downloads == 3
+    assert plugin.versions[0].downloads == 3
+
+
+@pytest.mark.asyncio
+async def test_increment_batch_endpoint(seed_db: "Database", client_unauth: "AsyncClient", mocker: "MockFixture"):
+    hit_many = mocker.patch("api.rate_limit.hit_many", return_value=[True, True, False, True])
+    reports = [
+        {"plugin": "plugin-1", "version": "1.0.0", "isUpdate": False},
+        {"plugin": "plugin-1", "version": "not_a_real_version"},
+        {"plugin": "plugin-2", "version": "2.0.0"},
+        {"plugin": "third", "version": "3.0.0"},
+        {"plugin": "plugin-1", "version": "0.2.0"},
+    ]
+
+    response = await client_unauth.post("/plugins/-/increment", json=reports)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [result["status"] for result in response.json()] == [200, 404, 200, 429, 200]
+    hit_many.assert_awaited_once()
+    hits = hit_many.await_args_list[0].args[1]
+    assert [plugin for plugin, _ in hits] == ["plugin-1", "plugin-2", "third", "plugin-1"]
+
+    await seed_db.flush_counters(seed_db.session)
+    seed_db.plugin_cache.fold_counts()
+    plugins = {plugin.name: plugin for plugin in seed_db.plugin_cache.plugins}
+    assert (plugins["plugin-1"].downloads, plugins["plugin-1"].updates) == (1, 1)
+    assert (plugins["plugin-2"].downloads, plugins["plugin-2"].updates) == (0, 1)
+    assert (plugins["third"].downloads, plugins["third"].updates) == (0, 0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("reports", [[], [{"plugin": "plugin-1", "version": "1.0.0"}] * 101], ids=["empty", "too_many"])
+async def test_increment_batch_endpoint_size(seed_db: "Database", client_unauth: "AsyncClient", reports: list):
+    response = await client_unauth.post("/plugins/-/increment", json=reports)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_plugin_stats_endpoint(
+    seed_db: "Database",
+    client_unauth: "AsyncClient",
+    mocker: "MockFixture",
+    freezer: "FrozenDateTimeFactory",
+):
+    mocker.patch("api.rate_limit.hit", return_value=True)  # remove ratelimit
+    freezer.move_to("2024-03-01T23:59:00Z")
+    for version_name, query in [("1.0.0", "?isUpdate=false"), ("1.0.0", ""), ("0.2.0", "")]:
+        await client_unauth.post(f"/plugins/plugin-1/versions/{version_name}/increment{query}")
+    await seed_db.flush_counters(seed_db.session)
+    await client_unauth.post("/plugins/plugin-1/versions/1.0.0/increment?isUpdate=false")
+    await seed_db.flush_counters(seed_db.session)
+    freezer.move_to("2024-03-02T00:01:00Z")
+    await client_unauth.post("/plugins/plugin-1/versions/1.0.0/increment")
+    await seed_db.flush_counters(seed_db.session)
+
+    response = await client_unauth.get("/plugins/plugin-1/stats")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "name": "plugin-1",
+        "start": "2024-02-02",
+        "end": "2024-03-02",
+        "days": [
+            {"day": "2024-03-01", "downloads": 2, "updates": 2},
+            {"day": "2024-03-02", "downloads": 0, "updates": 1},
+        ],
+        "versions": [
+            {"name": "0.2.0", "days": [{"day": "2024-03-01", "downloads": 0, "updates": 1}]},
+            {
+                "name": "1.0.0",
+                "days": [
+                    {"day": "2024-03-01", "downloads": 2, "updates": 1},
+                    {"day": "2024-03-02", "downloads": 0, "updates": 1},
+                ],
+            },
+        ],
+    }
+
+    response = await client_unauth.get("/plugins/plugin-1/stats", params={"from": "2024-03-02", "to": "2024-03-05"})
+    assert response.json()["days"] == [{"day": "2024-03-02", "downloads": 0, "updates": 1}]
+
+    await seed_db.prune_stats(seed_db.session, before=date(2024, 3, 2))
+    response = await client_unauth.get("/plugins/plugin-1/stats", params={"from": "2024-03-01"})
+    assert [day["day"] for day in response.json()["days"]] == ["2024-03-02"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("plugin_name", "params", "return_code"),
+    [
+        pytest.param("not_a_real_name", {}, status.HTTP_404_NOT_FOUND, id="invalid_name"),
+        pytest.param("plugin-1", {"from": "2024-03-02", "to": "2024-03-01"}, status.HTTP_400_BAD_REQUEST, id="range"),
+        pytest.param("plugin-1", {"from": "yesterday"}, status.HTTP_422_UNPROCESSABLE_ENTITY, id="invalid_date"),
+    ],
+)
+async def test_plugin_stats_endpoint_errors(
+    seed_db: "Database", client_unauth: "AsyncClient", plugin_name: str, params: dict, return_code: int
+):
+    response = await client_unauth.get(f"/plugins/{plugin_name}/stats", params=params)
+    assert response.status_code == return_code
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("client", [lazy_fixture("client_unauth"), lazy_fixture("client_auth")])
 @pytest.mark.parametrize(
@@ -452,6 +793,313 @@ async def test_plugins_list_endpoint(
     )
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("query", "first_ids", "excluded_ids"),
+    [
+        pytest.param("thrd", [3], {1, 2, 4}, id="typo"),
+        pytest.param("author-of-third", [3], {1, 2, 4}, id="author"),
+        pytest.param("Description of plugin-4", [4], {3}, id="description"),
+        pytest.param("tag-3", [3, 4], set(), id="tag"),
+        pytest.param("author-of-plugin-2", [2], {3}, id="exact-match-first"),
+        pytest.param("ugin-", [1, 2, 4], {3}, id="substring"),
+    ],
+)
+async def test_plugins_list_endpoint_text_search(
+    seed_db: "Database",
+    client_unauth: "AsyncClient",
+    query: str,
+    first_ids: list[int],
+    excluded_ids: set[int],
+):
+    response = await client_unauth.get(f"/plugins?{urlencode({'query': query})}")
+
+    assert response.status_code == 200
+    ids = [plugin["id"] for plugin in response.json()]
+    assert ids[: len(first_ids)] == first_ids
+    assert not excluded_ids & set(ids)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limit", [1, 3, 8])
+@pytest.mark.parametrize(
+    "params",
+    [
+        pytest.param({}, id="default"),
+        pytest.param({"hidden": "true", "sort_by": "name", "sort_direction": "desc"}, id="name-desc"),
+        pytest.param({"hidden": "true", "sort_by": "date"}, id="date-asc"),
+        pytest.param({"sort_by": "downloads", "sort_direction": "desc"}, id="downloads-desc"),
+        pytest.param({"query": "plugin", "hidden": "true"}, id="ranked"),
+        pytest.param({"tags": "tag-2", "hidden": "true", "sort_direction": "desc"}, id="tagged"),
+    ],
+)
+async def test_plugins_list_endpoint_pagination(
+    seed_db: "Database",
+    client_unauth: "AsyncClient",
+    params: "dict[str, str]",
+    limit: int,
+):
+    expected = (await client_unauth.get(f"/plugins?{urlencode(params)}")).json()
+
+    pages = []
+    cursor = None
+    while True:
+        page_params = {**params, "limit": limit}
+        if cursor is not None:
+            page_params["cursor"] = cursor
+        response = await client_unauth.get(f"/plugins?{urlencode(page_params)}")
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= limit
+        pages.append(page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        assert len(page) == limit
+
+    assert [plugin for page in pages for plugin in page] == expected
+    assert len(pages) == max(1, -(-len(expected) // limit))
+
+
+@pytest.mark.asyncio
+async def test_plugins_list_endpoint_pagination_survives_deletion(seed_db: "Database", client_unauth: "AsyncClient"):
+    response = await client_unauth.get("/plugins?limit=2")
+    assert [plugin["id"] for plugin in response.json()] == [1, 2]
+
+    await seed_db.delete_plugin(seed_db.session, 2)
+    response = await client_unauth.get(f"/plugins?limit=2&cursor={response.headers['X-Next-Cursor']}")
+
+    assert [plugin["id"] for plugin in response.json()] == [3, 4]
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not-a-cursor",
+        "WyJuYW1lIiwiYXNjIixmYWxzZSxbdHJ1ZSwxLDFdXQ",  # ["name","asc",false,[true,1,1]], number as a name
+        "W251bGwsImRlc2MiLGZhbHNlLFtmYWxzZSxudWxsLDFdXQ",  # [null,"desc",false,[false,null,1]], other ordering
+    ],
+)
+async def test_plugins_list_endpoint_invalid_cursor(seed_db: "Database", client_unauth: "AsyncClient", cursor: str):
+    response = await client_unauth.get(f"/plugins?sort_by=name&limit=2&cursor={cursor}")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["message"] == "Invalid cursor"
+
+
+@pytest.mark.asyncio
+async def test_plugins_list_endpoint_response_cache(seed_db: "Database", client_unauth: "AsyncClient"):
+    cache_key = ("third", (), False, None, SortDirection.ASC, None, None)
+    response = await client_unauth.get("/plugins?query=Third")
+
+    assert response.status_code == 200
+    assert [plugin["id"] for plugin in response.json()] == [3]
+    cached = seed_db.plugin_cache.get_response(cache_key)
+    assert cached is not None
+    assert cached.body == response.content
+
+    second_response = await client_unauth.get("/plugins?query=third")
+    assert second_response.content == response.content
+
+    await seed_db.update_cache(seed_db.session)
+    assert seed_db.plugin_cache.get_response(cache_key) is None
+
+
+def test_plugin_cache_evicts_least_recently_used_responses(mocker: "MockFixture"):
+    mocker.patch("database.cache.PLUGIN_RESPONSE_CACHE_SIZE", 2)
+    cache = PluginCache()
+    responses = {key: CachedResponse(key.encode(), f'"{key}"') for key in ("popular", "once", "other")}
+
+    cache.store_response(cache.generation, "popular", responses["popular"])
+    cache.store_response(cache.generation, "once", responses["once"])
+    assert cache.get_response("popular") == responses["popular"]
+    cache.store_response(cache.generation, "other", responses["other"])
+
+    assert cache.get_response("once") is None
+    assert cache.get_response("popular") == responses["popular"]
+    assert cache.get_response("other") == responses["other"]
+    cache.store_response(cache.generation - 1, "stale", responses["once"])
+    assert cache.get_response("stale") is None
+
+
+@pytest.mark.asyncio
+async def test_plugin_cache_swaps_snapshots(seed_db: "Database"):
+    snapshot = seed_db.plugin_cache.snapshot
+
+    await seed_db.delete_plugin(seed_db.session, 1)
+
+    assert seed_db.plugin_cache.snapshot is not snapshot
+    assert seed_db.plugin_cache.generation == snapshot.generation + 1
+    assert 1 in {plugin.id for plugin in snapshot.plugins}
+    assert 1 not in {plugin.id for plugin in seed_db.plugin_cache.plugins}
+    # Tags are shared between the records of a snapshot
+    plugins = {plugin.id: plugin for plugin in snapshot.plugins}
+    assert plugins[1].tags[1] is plugins[2].tags[0]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 3, 8, 500])
+async def test_plugin_cache_loads_whole_catalog(seed_db: "Database", mocker: "MockFixture", chunk_size: int):
+    mocker.patch("database.database.PLUGIN_CACHE_LOAD_CHUNK_SIZE", chunk_size)
+
+    await seed_db.update_cache(seed_db.session)
+
+    assert sorted(plugin.id for plugin in seed_db.plugin_cache.plugins) == [1, 2, 3, 4, 5, 6, 7, 8]
+
+
+@pytest.mark.asyncio
+async def test_plugin_cache_updates_incrementally(seed_db: "Database", mocker: "MockFixture"):
+    full_reload = mocker.spy(seed_db, "_search")
+    generation = seed_db.plugin_cache.generation
+
+    plugin = await seed_db.get_plugin_by_id(seed_db.session, 2)
+    await seed_db.update_artifact(seed_db.session, plugin, description="Updated description")
+    await seed_db.insert_version(seed_db.session, 2, name="3.0.0", hash="new-hash")
+    await seed_db.delete_plugin(seed_db.session, 1)
+
+    full_reload.assert_not_called()
+    assert seed_db.plugin_cache.generation == generation + 3
+    plugins = {plugin.id: plugin for plugin in seed_db.plugin_cache.plugins}
+    assert set(plugins) == {2, 3, 4, 5, 6, 7, 8}
+    assert plugins[2].description == "Updated description"
+    assert [version.name for version in plugins[2].versions] == ["3.0.0", "2.0.0", "1.1.0"]
+    assert seed_db.plugin_cache.version_id("plugin-2", "3.0.0") == plugins[2].versions[0].id
+    assert seed_db.plugin_cache.version_id("plugin-1", "1.0.0") is None
+    assert seed_db.plugin_cache.get("plugin-1") is None
+
+
+@pytest.mark.asyncio
+async def test_plugin_cache_patches_indexes(seed_db: "Database", mocker: "MockFixture"):
+    full_index = mocker.spy(TrigramIndex, "__init__")
+
+    plugin = await seed_db.get_plugin_by_id(seed_db.session, 3)
+    await seed_db.update_artifact(seed_db.session, plugin, description="Patched", tags=["tag-2", "brand-new"])
+    await seed_db.delete_plugin(seed_db.session, 2)
+    await seed_db.insert_version(seed_db.session, 4, name="5.0.0", hash="new-hash")
+    await seed_db.delete_plugin(seed_db.session, 8)
+    new = await seed_db.insert_artifact(seed_db.session, name="new", author="author", description="New", tags=["tag-1"])
+
+    assert all(call.args[1] == () for call in full_index.call_args_list)
+    patched = seed_db.plugin_cache.snapshot
+    rebuilt = CatalogSnapshot(patched.plugins)
+    assert [plugin.id for plugin in patched.plugins] == [1, 7, 3, 4, 5, 6, new.id]
+    assert patched.names == rebuilt.names
+    assert patched.version_ids == rebuilt.version_ids
+    assert patched.tags == rebuilt.tags
+    assert patched.tag_index == rebuilt.tag_index
+    assert patched.orderings == rebuilt.orderings
+    assert vars(patched.text_index) == vars(rebuilt.text_index)
+    assert [plugin.id for plugin in seed_db.plugin_cache.search("patched").plugins] == [3]
+
+
+@pytest.mark.asyncio
+async def test_plugin_cache_defers_prerendering(seed_db: "Database", mocker: "MockFixture"):
+    mocker.patch("database.cache.PLUGIN_PRERENDER_DELAY", 0)
+    cache = PluginCache()
+    subscriber = mocker.Mock()
+    cache.subscribe(subscriber, deferred=True)
+
+    await seed_db.update_cache(seed_db.session)
+    cache.replace(seed_db.plugin_cache.plugins)
+    cache.evict(1)
+    cache.evict(2)
+    subscriber.assert_not_called()
+
+    await asyncio.sleep(0.01)
+    subscriber.assert_called_once_with(cache)
+    assert cache.deferred_notification is None
+
+
+@pytest.mark.asyncio
+async def test_artifact_aggregates_follow_versions(seed_db: "Database", freezer: "FrozenDateTimeFactory"):
+    plugin = await seed_db.get_plugin_by_id(seed_db.session, 2)
+    created = plugin.created
+    assert plugin.updated == max(version.created for version in plugin.versions if version.created is not None)
+
+    freezer.move_to("2024-01-01T00:00:00Z")
+    await seed_db.insert_version(seed_db.session, 2, name="3.0.0", hash="new-hash")
+    seed_db.session.expunge_all()
+
+    plugin = await seed_db.get_plugin_by_id(seed_db.session, 2)
+    assert plugin.created == created
+    assert plugin.updated == datetime(2024, 1, 1, tzinfo=UTC)
+    assert (plugin.downloads, plugin.updates) == (0, 0)
+
+
+def test_remember_stored_files(seed_db: "Database", mocker: "MockFixture"):
+    uploader = mocker.patch("api.uploader", B2Uploader(None, None, None))
+
+    remember_stored_files(seed_db.plugin_cache)
+
+    plugin = seed_db.plugin_cache.get("plugin-2")
+    assert plugin is not None
+    assert plugin.image_path in uploader.stored
+    assert {construct_version_path(version.hash) for version in plugin.versions if version.hash} <= uploader.stored
+
+
+@pytest.mark.asyncio
+async def test_plugins_list_endpoint_conditional_get(seed_db: "Database", client_unauth: "AsyncClient"):
+    response = await client_unauth.get("/plugins")
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+
+    not_modified = await client_unauth.get("/plugins", headers={"If-None-Match": f'W/"stale", {etag}'})
+    assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+    assert not_modified.content == b""
+    assert not_modified.headers["ETag"] == etag
+
+    not_modified = await client_unauth.get("/plugins", headers={"If-Modified-Since": last_modified})
+    assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+
+    other_query = await client_unauth.get("/plugins?query=third", headers={"If-None-Match": etag})
+    assert other_query.status_code == status.HTTP_200_OK
+    assert other_query.headers["ETag"] != etag
+
+    await seed_db.delete_plugin(seed_db.session, 1)
+    modified = await client_unauth.get("/plugins", headers={"If-None-Match": etag})
+    assert modified.status_code == status.HTTP_200_OK
+    assert 1 not in {plugin["id"] for plugin in modified.json()}
+
+
+@pytest.mark.asyncio
+async def test_plugins_list_endpoint_precompressed(seed_db: "Database", client_unauth: "AsyncClient"):
+    cached = seed_db.plugin_cache.get_response(("", (), False, None, SortDirection.ASC, None, None))
+    assert cached is not None
+    assert cached.gzip_body is not None
+
+    compressed = await client_unauth.get("/plugins", headers={"Accept-Encoding": "br, gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert compressed.headers["ETag"] != cached.etag
+
+    identity = await client_unauth.get("/plugins", headers={"Accept-Encoding": "gzip;q=0, identity"})
+    assert "Content-Encoding" not in identity.headers
+    assert identity.headers["ETag"] == cached.etag
+    assert identity.content == cached.body
+    assert compressed.json() == identity.json()
+
+    not_modified = await client_unauth.get(
+        "/plugins", headers={"Accept-Encoding": "gzip", "If-None-Match": compressed.headers["ETag"]}
+    )
+    assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.asyncio
+async def test_plugins_list_endpoint_compresses_only_default_listing(
+    seed_db: "Database", client_unauth: "AsyncClient", mocker: "MockFixture"
+):
+    gzip_compress = mocker.spy(api, "gzip_compress")
+
+    response = await client_unauth.get("/plugins?sort_by=downloads", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
+    gzip_compress.assert_not_called()
+    cached = seed_db.plugin_cache.get_response(("", (), False, SortType.DOWNLOADS, SortDirection.ASC, None, None))
+    assert cached is not None
+    assert cached.gzip_body is None
+
+
 @pytest.mark.asyncio
 async def test_submit_endpoint_requires_auth(client_unauth: "AsyncClient"):
     response = await client_unauth.post("/__submit")
@@ -659,6 +1307,64 @@ async def test_submit_endpoint(
             assert plugin_id not in returned_ids
 
 
+@pytest.mark.parametrize("plugin_submit_data", ["new-plugin"], indirect=True)
+@pytest.mark.asyncio
+async def test_submit_endpoint_uploads_concurrently(
+    seed_db: "Database",
+    client_auth: "AsyncClient",
+    plugin_submit_data: "tuple[dict, dict]",
+    mocker: "MockFixture",
+):
+    # Both uploads have to be running at once to get past the barrier
+    barrier = asyncio.Barrier(2)
+
+    async def upload_image(plugin_name: str, image_url: str) -> str:
+        await asyncio.wait_for(barrier.wait(), 1)
+        return "artifact_images/new-plugin.png"
+
+    async def upload_version(file) -> dict:
+        await asyncio.wait_for(barrier.wait(), 1)
+        return {"hash": "a" * 64}
+
+    mocker.patch("api.upload_image", side_effect=upload_image)
+    mocker.patch("api.upload_version", side_effect=upload_version)
+    submit_data, submit_files = plugin_submit_data
+
+    response = await client_auth.post("/__submit", data=submit_data, files=submit_files)
+
+    assert response.status_code == status.HTTP_201_CREATED, response.text
+    assert response.json()["image_url"] == "hxxp://fake.domain/artifact_images/new-plugin.png"
+    assert response.json()["versions"][0]["hash"] == "a" * 64
+
+
+@pytest.mark.parametrize("plugin_submit_data", ["plugin-2"], indirect=True)
+@pytest.mark.asyncio
+async def test_submit_endpoint_cancels_uploads_on_failure(
+    seed_db: "Database",
+    client_auth: "AsyncClient",
+    plugin_submit_data: "tuple[dict, dict]",
+    mocker: "MockFixture",
+):
+    cancelled = []
+
+    async def upload_version(file) -> "NoReturn":
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(file)
+            raise
+        raise AssertionError("Upload wasn't cancelled")
+
+    mocker.patch("api.upload_version", side_effect=upload_version)
+    submit_data, submit_files = plugin_submit_data
+
+    response = await client_auth.post("/__submit", data=submit_data, files=submit_files)
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["message"] == "Version already exists"
+    assert len(cancelled) == 1
+
+
 @pytest.mark.asyncio
 async def test_update_endpoint_requires_auth(client_unauth: "AsyncClient"):
     response = await client_unauth.post("/__update")
@@ -784,6 +1490,7 @@ async def test_update_endpoint(
     assert len(plugin.tags) == 2
     assert plugin.tags[0].tag == "new-tag-1"
     assert plugin.tags[1].tag == "tag-2"
+    assert plugin.created is not None and plugin.updated is not None
     assert plugin.created.isoformat().replace("+00:00", "Z") == min(resulting_versions_dates)
     assert plugin.updated.isoformat().replace("+00:00", "Z") == max(resulting_versions_dates)
     assert len(plugin.versions) == len(with_versions)